@@ -2,34 +2,111 @@ import sys, random
 import math
 import numpy as np
 
-import pygame
-from pygame.locals import *
-from pygame.color import THECOLORS
-
-import pymunk
-from pymunk.vec2d import Vec2d
-import pymunk.pygame_util
+# pygame is only imported by games that draw, and pymunk by the ones using
+# its physics, so headless NumPy games start without either
+from physics import NumpySpace
+from spatial import SpatialHash, INDEX_MIN
+from crowd import Crowd
+from lidar import Lidar
+from profiling import profiler
+from trajectory import PathBuffer, TrajectoryRecorder
 
 # PyGame init
+# The window is only opened by a GameClass that draws, so headless
+# simulations never touch the display.
 width = 1200
 height = 900
-pygame.init()
-screen = pygame.display.set_mode((width, height),RESIZABLE,32)
-clock = pygame.time.Clock()
+screen = None
+clock = None
+# pygame's THECOLORS of the shapes
+colors = {
+    'white': (255, 255, 255, 255),
+    'brown': (165, 42, 42, 255),
+    'orange': (255, 165, 0, 255),
+    'blue': (0, 0, 255, 255),
+    'red': (255, 0, 0, 255),
+}
+
+def init_display():
+    """Open the pygame window and clock if they are not opened yet"""
+    global screen, clock
+    if screen is None:
+        import pygame
+        pygame.init()
+        screen = pygame.display.set_mode((width, height),pygame.RESIZABLE,32)
+        clock = pygame.time.Clock()
+    return screen
 
 # Global variables
 robot_radius = 30
 robot_velocity = 200
 obs_radius = 30
+# Grid cell size of the spatial indexes
+cell_size = 4 * robot_radius
+# Moving pedestrians
+ped_radius = 15
+ped_speed = 80
+# Getting closer than this to a pedestrian is penalized
+comfort_distance = 30
+# Reading of a lidar beam which hits nothing
+lidar_range = 300
+
+# End points of the border segments
+border_points = [
+    ((0, 1), (0, height)),
+    ((1, height), (width, height)),
+    ((width - 1, height), (width - 1, 1)),
+    ((1, 1), (width, 1)),
+    # ((width/2., 1), (width/2., height*0.75)),
+]
+
+# Obstacle positions when they are not random
+fixed_obstacles = [
+    (390, 774), (917, 349), (660, 580), (730, 344), (712, 204),
+    (431, 516), (1048, 199), (1155, 689), (660, 134), (826, 589),
+    # (600,450),
+]
+
+def rotated_degrees(v, angle_degrees):
+    """Rotate a 2d vector, same arithmetic as pymunk's Vec2d.rotated_degrees"""
+    radians = math.radians(angle_degrees)
+    cos = math.cos(radians)
+    sin = math.sin(radians)
+    return v[0]*cos - v[1]*sin, v[0]*sin + v[1]*cos
 
 class GameClass:
-    def __init__(self, draw_screen, display_path, fps):
+    def __init__(self, draw_screen, display_path, fps, physics='pymunk',
+                 num_obstacles=None, spatial_index=False, num_pedestrians=0,
+                 display_fps=None, realtime=True, action_repeat=1, lidar_beams=0):
         # Physics conditions.
-        self.space = pymunk.Space()
-        self.space.gravity = pymunk.Vec2d(0., 0.)
+        # physics is 'pymunk', or 'numpy' for the faster NumpySpace which
+        # only supports the static scene built here.
+        self.physics = physics
+        # With spatial_index, the numpy contact search and the sensor
+        # queries only look at the shapes in the grid cells around the robot,
+        # once there are INDEX_MIN of them. It only pays off with hundreds
+        # of obstacles, see `python spatial.py`.
+        self.spatial_index = spatial_index
+        self.obstacle_index = SpatialHash(cell_size) if spatial_index else None
+        if self.physics == 'numpy':
+            self.space = NumpySpace(cell_size if spatial_index else None)
+        else:
+            import pymunk
+            self.space = pymunk.Space()
+            self.space.gravity = pymunk.Vec2d(0., 0.)
         self.draw_screen = draw_screen 
         self.display_path = display_path
+        # The physics always step by 1/fps of a simulated second. A window
+        # shows display_fps frames per simulated second (default fps), in
+        # wall clock time if realtime, else as fast as the CPU allows.
         self.fps = fps
+        self.display_fps = fps if display_fps is None else display_fps
+        self.steps_per_frame = max(1, int(round(fps / self.display_fps)))
+        self.realtime = realtime
+        self.physics_steps = 0
+        # Every frame_step applies its action for action_repeat physics
+        # steps and returns the sum of their rewards
+        self.action_repeat = action_repeat
 
         # Exit the game
         self.exit = 0
@@ -40,6 +117,11 @@ class GameClass:
         # Record whether the robot hit something
         self.hit = 0
 
+        # Contacts of the robot during the last physics step
+        self.hit_obstacle = False
+        self.hit_wall = False
+        self.touch_goal = False
+
         # Add borders in the space
         self.add_borders()
 
@@ -47,47 +129,82 @@ class GameClass:
         self.add_robot(100, 100)
 
         # Add some obstacles in the space
-        # For now, the obstacles have fixed position
-        self.num_obstacles = 10
-        self.add_obstacles(False) # if True, obstacles are randomly spanned in the space
+        # By default the 10 obstacles have fixed position, num_obstacles
+        # obstacles are randomly spanned in the space
+        self.num_obstacles = 10 if num_obstacles is None else num_obstacles
+        self.random_obstacles = num_obstacles is not None
+        self.add_obstacles(self.random_obstacles)
 
         # Add the goal in the space
         self.add_goal(width - 100, height-100)
         self.reach_goal = 0
+        if self.physics != 'numpy':
+            self.add_collision_handlers()
+
+        # Add the moving pedestrians. They are not pymunk bodies, the crowd
+        # is stepped as a whole after the physics and only penalizes the
+        # robot when they touch. The state gets 2 more values: the gap to
+        # the nearest pedestrian and how fast it is closing in.
+        self.crowd = None
+        self.pedestrian_gap = np.inf
+        if num_pedestrians > 0:
+            self.crowd = Crowd(num_pedestrians, width, height, ped_radius, ped_speed,
+                               self.obstacle_positions, obs_radius,
+                               np.random.RandomState(random.randrange(2**32)))
+        self.state_dim = 3 if self.crowd is None else 5
+
+        # With lidar_beams, the state ends with the range of every beam
+        # of a lidar turning with the robot
+        self.lidar = None
+        if lidar_beams > 0:
+            self.lidar = Lidar(lidar_beams, lidar_range, segments=border_points)
+            self.state_dim += lidar_beams
         
-        # Track the path of the robot
-        self.path_holder = []
-        # Draw stuffs on the screen
-        self.draw_options = pymunk.pygame_util.DrawOptions(screen)
+        # Track the path of the robot, one point per physics step. The
+        # path is drawn incrementally on path_surface, the background of
+        # every frame.
+        self.path = PathBuffer()
+        self.path_surface = None
+        self.path_drawn = 0
+        # Records the episode for offline rendering, see start_recording
+        self.recorder = None
+        # Draw stuffs on the screen, rendering is skipped when headless
+        self.draw_options = None
+        if self.draw_screen and self.physics == 'numpy':
+            # NumpySpace draws straight on the screen surface
+            self.draw_options = init_display()
+        elif self.draw_screen:
+            import pymunk.pygame_util
+            self.draw_options = pymunk.pygame_util.DrawOptions(init_display())
 
     def add_borders(self):
+        if self.physics == 'numpy':
+            self.borders = list(range(len(border_points)))
+            for a, b in border_points:
+                self.space.add_segment(a, b, 5)
+            return
+
+        import pymunk
         self.borders = [
-            pymunk.Segment(
-                self.space.static_body,
-                (0, 1), (0, height), 5),
-            pymunk.Segment(
-                self.space.static_body,
-                (1, height), (width, height), 5),
-            pymunk.Segment(
-                self.space.static_body,
-                (width - 1, height), (width - 1, 1), 5),
-            pymunk.Segment(
-                self.space.static_body,
-                (1, 1), (width, 1), 5)
-            # pymunk.Segment(
-            #     self.space.static_body,
-            #     (width/2., 1), (width/2., height*0.75), 5)
+            pymunk.Segment(self.space.static_body, a, b, 5)
+            for a, b in border_points
         ]
         for b in self.borders:
             b.friction = 1.
             b.group = 1
             b.collision_type = 1
-            b.color = THECOLORS['brown']
+            b.color = colors['brown']
             b.elasticity = 1
         self.space.add(self.borders)
 
     def add_robot(self, x, y):
         """Add a circle robot at a given position"""
+        if self.physics == 'numpy':
+            self.robot_body = self.space.add_robot(x, y, robot_radius, robot_velocity)
+            self.robot_body.velocity = random.choice([(1, 10), (-1, 10)])
+            return
+
+        import pymunk
         mass = 1
         radius = robot_radius
         inertia = pymunk.moment_for_circle(mass, 0, radius, (0, 0))
@@ -97,13 +214,17 @@ class GameClass:
         self.robot_body.velocity_func = self.constant_velocity
 
         self.robot_shape = pymunk.Circle(self.robot_body, radius, (0, 0))
-        self.robot_shape.color = THECOLORS["orange"]
+        self.robot_shape.color = colors["orange"]
         self.robot_shape.elasticity = 1
         self.robot_shape.collision_type = 2
         self.space.add(self.robot_body, self.robot_shape)
 
     def add_obstacle(self, x, y):
         """Add an obstacle at a given position"""
+        if self.physics == 'numpy':
+            return self.space.add_obstacle(x, y, obs_radius)
+
+        import pymunk
         # mass = 1
         radius = obs_radius
         # inertia = pymunk.moment_for_circle(mass, 0, radius, (0,0))
@@ -113,52 +234,137 @@ class GameClass:
 
         obs_body.position = x, y
         obs_shape = pymunk.Circle(obs_body, radius, (0, 0))
-        obs_shape.color = THECOLORS["blue"]
+        obs_shape.color = colors["blue"]
         obs_shape.elasticity = 1
         self.space.add(obs_body, obs_shape)
         return obs_shape
 
-    def add_obstacles(self,isRandom):
-        self.obstacles = []
+    def obstacle_layout(self, isRandom):
         if isRandom:
-            for i in range(self.num_obstacles):
-                self.obstacles.append(self.add_obstacle(random.randint(obs_radius, width - obs_radius),
-                                                    random.randint(obs_radius, height - obs_radius)))
+            return [(random.randint(obs_radius, width - obs_radius),
+                     random.randint(obs_radius, height - obs_radius))
+                    for i in range(self.num_obstacles)]
+        return fixed_obstacles
+
+    def add_obstacles(self,isRandom):
+        positions = self.obstacle_layout(isRandom)
+        self.obstacle_positions = np.array(positions, dtype=float)
+        self.obstacles = [self.add_obstacle(x, y) for x, y in positions]
+        if self.obstacle_index is not None:
+            for i, (x, y) in enumerate(positions):
+                self.obstacle_index.insert_circle(i, x, y, obs_radius)
+
+    def move_obstacles(self, positions):
+        """Move the existing obstacles to new positions"""
+        self.obstacle_positions[:] = positions
+        for i, (obstacle, (x, y)) in enumerate(zip(self.obstacles, positions)):
+            if self.physics == 'numpy':
+                self.space.move_circle(obstacle, x, y)
+            else:
+                obstacle.body.position = x, y
+                self.space.reindex_shapes_for_body(obstacle.body)
+            if self.obstacle_index is not None:
+                self.obstacle_index.move(i, x - obs_radius, y - obs_radius,
+                                         x + obs_radius, y + obs_radius)
+
+    def reset(self, seed=None):
+        """
+        Start a new episode in place, without building a new space. The
+        game is left as a new GameClass with the same arguments would be:
+        the random module is used in the same order, so after
+        random.seed(s) both play the same episode. With a seed, the random
+        module is seeded with it first.
+        """
+        if seed is not None:
+            random.seed(seed)
+        self.exit = 0
+        self.num_steps = 0
+        self.physics_steps = 0
+        self.hit = 0
+        self.reach_goal = 0
+        self.hit_obstacle = False
+        self.hit_wall = False
+        self.touch_goal = False
+        self.pedestrian_gap = np.inf
+        self.path.clear()
+        self.path_drawn = 0
+        if self.path_surface is not None:
+            self.path_surface.fill(colors["white"])
+
+        # A new robot at the start. Chipmunk keeps the penetration fix of
+        # the last contact in the body, so the pymunk one is replaced too.
+        if self.physics == 'numpy':
+            self.space.reset()
         else:
-            self.obstacles.append(self.add_obstacle(390, 774))
-            self.obstacles.append(self.add_obstacle(917, 349))
-            self.obstacles.append(self.add_obstacle(660, 580))
-            self.obstacles.append(self.add_obstacle(730, 344))
-            self.obstacles.append(self.add_obstacle(712, 204))
-            self.obstacles.append(self.add_obstacle(431, 516))
-            self.obstacles.append(self.add_obstacle(1048, 199))
-            self.obstacles.append(self.add_obstacle(1155, 689))
-            self.obstacles.append(self.add_obstacle(660, 134))
-            self.obstacles.append(self.add_obstacle(826, 589))
-
-            # self.obstacles.append(self.add_obstacle(600,450))
+            self.space.remove(self.robot_body, self.robot_shape)
+        self.add_robot(100, 100)
+
+        if self.random_obstacles:
+            self.move_obstacles(self.obstacle_layout(True))
+        if self.crowd is not None:
+            self.crowd.reset(np.random.RandomState(random.randrange(2**32)),
+                             self.obstacle_positions)
+        # A recording in progress starts over with the new episode
+        if self.recorder is not None:
+            self.start_recording()
+
+    def scene(self):
+        """The static part of the episode, what a recording needs besides the steps"""
+        return {
+            'width': width,
+            'height': height,
+            'fps': self.fps,
+            'robot_radius': robot_radius,
+            'obstacle_radius': obs_radius,
+            'obstacles': self.obstacle_positions.copy(),
+            'goal': np.array(self.goal_position, dtype=float),
+            'goal_radius': self.goal_radius,
+            'borders': np.array(border_points, dtype=float),
+            'num_pedestrians': 0 if self.crowd is None else len(self.crowd),
+            'pedestrian_radius': ped_radius,
+        }
+
+    def start_recording(self):
+        """Record every following physics step of the episode"""
+        self.recorder = TrajectoryRecorder(self.scene())
+        return self.recorder
+
+    def stop_recording(self, path=None):
+        """Stop recording, save the trajectory to path if given and return the recorder"""
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None and path is not None:
+            recorder.save(path)
+        return recorder
 
     def draw_path(self):
-         # Update the path points and draw the path
-        position = np.array(self.robot_body.position)
-        position[1] = height-position[1]
-        if len(self.path_holder)>1:
-            notCollapes = np.linalg.norm(
-                self.path_holder[-1]-self.path_holder[-2]) >= 0.1
-            if notCollapes:
-                self.path_holder.append(position)
+        # Only the segments added since the last frame are drawn, so the
+        # cost doesn't grow with the length of the path
+        import pygame
+        if self.path_surface is None or self.path_surface.get_size() != screen.get_size():
+            self.path_surface = pygame.Surface(screen.get_size()).convert()
+            self.path_surface.fill(colors["white"])
+            self.path_drawn = 0
+        points = self.path.array()[max(self.path_drawn - 1, 0):]
+        if len(points) > 1:
+            points = points * (1, -1) + (0, self.path_surface.get_height())
             pygame.draw.aalines(
-                screen, THECOLORS["red"], False, self.path_holder)
-        else:
-            self.path_holder.append(position)
+                self.path_surface, colors["red"], False, points.tolist())
+        self.path_drawn = len(self.path)
+        screen.blit(self.path_surface, (0, 0))
             
     def add_goal(self, x, y):
         """Add the goal at a given position"""
+        self.goal_position = x, y
+        self.goal_radius = 10
+        if self.physics == 'numpy':
+            self.goal_shape = self.space.add_goal(x, y, self.goal_radius)
+            return
+
+        import pymunk
         self.goal = pymunk.Body(body_type=pymunk.Body.STATIC)
         self.goal.position = x, y
-        self.goal_radius = 10
         self.goal_shape = pymunk.Circle(self.goal, self.goal_radius, (0, 0))
-        self.goal_shape.color = THECOLORS["red"]
+        self.goal_shape.color = colors["red"]
         self.goal_shape.collision_type = 2
         self.goal_shape.elasticity = 0
         self.space.add(self.goal, self.goal_shape)
@@ -167,33 +373,61 @@ class GameClass:
     def constant_velocity(self,body, gravity, damping, dt):
         body.velocity = body.velocity.normalized() * robot_velocity
 
-    def get_sensor_data(self):
-        readings = list([-100]*self.num_obstacles)
-        for i, o in enumerate(self.obstacles):
-            distance = self.robot_body.position.get_distance(o.body.position)
-            readings[i] = distance - robot_radius - obs_radius
+    def get_sensor_data(self, sensor_range=None):
+        # Gap between the robot and each obstacle, at most sensor_range.
+        # With the spatial index only the obstacles near the robot are
+        # measured, the others read sensor_range.
+        position = np.array(self.robot_body.position)
+        if sensor_range is None or self.obstacle_index is None or \
+                len(self.obstacle_index) < INDEX_MIN:
+            distances = np.linalg.norm(self.obstacle_positions - position, axis=1)
+            gaps = distances - robot_radius - obs_radius
+            return gaps if sensor_range is None else np.minimum(gaps, sensor_range)
+        readings = np.full(self.num_obstacles, float(sensor_range))
+        near = self.obstacle_index.query_circle(position[0], position[1],
+                                                sensor_range + robot_radius)
+        if len(near):
+            distances = np.linalg.norm(self.obstacle_positions[near] - position, axis=1)
+            readings[near] = np.minimum(distances - robot_radius - obs_radius, sensor_range)
         return readings
 
+    def get_lidar_data(self):
+        # Distance from the robot's center along every beam to the nearest
+        # obstacle, pedestrian or border. lidar.circle_hits drops the
+        # obstacles out of range in one pass, cheaper than an index query.
+        x, y = self.robot_body.position
+        centers = self.obstacle_positions
+        radii = obs_radius
+        if self.crowd is not None:
+            radii = np.repeat((obs_radius, ped_radius), (len(centers), len(self.crowd)))
+            centers = np.vstack((centers, self.crowd.positions))
+        return self.lidar.scan((x, y), self.robot_body.angle, centers, radii)
+
+    def add_collision_handlers(self):
+        """
+        Record the contacts pymunk finds while stepping, keyed on the
+        collision types: robot and goal 2, borders 1, obstacles 0.
+        """
+        for collision_type, flag in [(0, 'hit_obstacle'), (1, 'hit_wall'), (2, 'touch_goal')]:
+            handler = self.space.add_collision_handler(2, collision_type)
+            handler.pre_solve = self.contact_recorder(flag)
+
+    def contact_recorder(self, flag):
+        def pre_solve(arbiter, space, data):
+            setattr(self, flag, True)
+            return True
+        return pre_solve
+
+    # The contact flags are set once per physics step, by the collision
+    # handlers or by NumpySpace.
     def check_hit_obstacle(self):
-        for o_shape in self.obstacles:
-            if self.robot_shape.shapes_collide(o_shape).points:
-                print("Hit an obstacle!")
-                return True
-        return False
+        return self.hit_obstacle
 
     def check_hit_wall(self):
-        for b in self.borders:
-            if self.robot_shape.shapes_collide(b).points:
-                print("Hit the wall!")
-                return True
-        return False
+        return self.hit_wall
 
     def check_reach_goal(self):
-        if self.robot_shape.shapes_collide(self.goal_shape).points:
-            print("reach goal!")
-            return True
-        else:
-            return False
+        return self.touch_goal
 
     def get_reward(self,readings):
         reward = -self.num_steps/self.fps
@@ -213,44 +447,49 @@ class GameClass:
         if self.check_reach_goal():
             reward += 10000
             self.reach_goal = 1
+
+        # Hitting a pedestrian costs as much as an obstacle, entering its
+        # comfort distance up to 10
+        if self.pedestrian_gap < 0:
+            reward -= 50
+            self.hit = 1
+        elif self.pedestrian_gap < comfort_distance:
+            reward -= 10 * (1 - self.pedestrian_gap / comfort_distance)
         return reward
 
     def frame_step(self, action):
+        total_reward = 0
+        for i in range(self.action_repeat):
+            reward, state = self.physics_step(action)
+            total_reward += reward
+            if self.exit:
+                break
+        return total_reward, state
+
+    def physics_step(self, action):
         # Update the screen and stuff every second
         self.update(self.fps)
         self.num_steps += 1
 
         # Align the robot's pointing angle to its velocity
-        r_v = self.robot_body.velocity.get_length()
-        r_vx = self.robot_body.velocity.x
-        r_vy = self.robot_body.velocity.y
+        r_vx, r_vy = self.robot_body.velocity
+        r_v = math.sqrt(r_vx**2 + r_vy**2)
         if r_v != 0:
             if r_vx >= 0:
                 self.robot_body.angle = math.asin(r_vy / r_v)
             else:
                 self.robot_body.angle = math.pi - math.asin(r_vy / r_v)
 
-        # Manually control the robot's action for debuging
-        for event in pygame.event.get():
-            if event.type == KEYDOWN and event.key == K_RIGHT:
-                self.robot_body.velocity = self.robot_body.velocity.rotated_degrees(-45)
-            elif event.type == KEYDOWN and event.key == K_LEFT:
-                self.robot_body.velocity = self.robot_body.velocity.rotated_degrees(45)
+        # Manual control and exit events only exist with a window
+        if self.draw_screen:
+            with profiler.phase('render'):
+                self.handle_events()
 
         # Use given action
         if action == 0: # Turn right
-            self.robot_body.velocity = self.robot_body.velocity.rotated_degrees(-5)
+            self.robot_body.velocity = rotated_degrees(self.robot_body.velocity, -5)
         elif action == 1: # Turn left
-            self.robot_body.velocity = self.robot_body.velocity.rotated_degrees(5)
-
-        # Exit the game
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                # sys.exit(0)
-                self.exit = 1
-            elif event.type == pygame.KEYDOWN and (event.key in [pygame.K_ESCAPE, pygame.K_q]):
-                # sys.exit(0)
-                self.exit = 1
+            self.robot_body.velocity = rotated_degrees(self.robot_body.velocity, 5)
 
         # Stop if reach the goal
         if self.check_reach_goal():
@@ -259,33 +498,118 @@ class GameClass:
             self.exit = 1
             
         # Get the current state of the robot
-        position = np.array(self.robot_body.position)
-        angle = np.array(self.robot_body.angle)
-        readings = self.get_sensor_data()
-        # state = np.array(readings).reshape((self.num_obstacles,))
-        state = np.hstack((position,angle))
-        reward = self.get_reward(readings)
+        with profiler.phase('state'):
+            position = np.array(self.robot_body.position)
+            angle = np.array(self.robot_body.angle)
+            # state = np.array(readings).reshape((self.num_obstacles,))
+            state = np.hstack((position,angle))
+            self.path.append(position)
+            if self.crowd is not None:
+                self.pedestrian_gap, closing = self.crowd.nearest(
+                    position, np.array(self.robot_body.velocity), robot_radius)
+                state = np.hstack((state, self.pedestrian_gap, closing))
+            readings = None
+            if self.lidar is not None:
+                readings = self.get_lidar_data()
+                state = np.hstack((state, readings))
+            reward = self.get_reward(readings)
+            if self.recorder is not None:
+                self.recorder.add(position[0], position[1], self.robot_body.angle, action, reward,
+                                  None if self.crowd is None else self.crowd.positions)
         
         # if self.hit or self.reach_goal:
         #     print("action: %d, reward: %f, reach goal? %d" % (action, reward,self.reach_goal))
         return reward, state
 
-    def update(self, fps):
-        screen.fill(THECOLORS["white"])
+    def handle_events(self):
+        import pygame
+        for event in pygame.event.get():
+            # Manually control the robot's action for debuging
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_RIGHT:
+                self.robot_body.velocity = rotated_degrees(self.robot_body.velocity, -45)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_LEFT:
+                self.robot_body.velocity = rotated_degrees(self.robot_body.velocity, 45)
+            # Exit the game
+            elif event.type == pygame.QUIT:
+                # sys.exit(0)
+                self.exit = 1
+            elif event.type == pygame.KEYDOWN and (event.key in [pygame.K_ESCAPE, pygame.K_q]):
+                # sys.exit(0)
+                self.exit = 1
+
+    def render(self):
         if self.display_path:
             self.draw_path()
+        else:
+            screen.fill(colors["white"])
         self.space.debug_draw(self.draw_options)
-        self.space.step(1 / fps)
-        if self.draw_screen:
-            pygame.display.flip()
-            clock.tick(fps)
+        if self.crowd is not None:
+            self.crowd.draw(screen)
 
+    def update(self, fps):
+        # Drawing never changes the physics, so a headless game
+        # returns the same rewards and states as a rendered one.
+        draw = self.draw_screen and self.physics_steps % self.steps_per_frame == 0
+        self.physics_steps += 1
+        if draw:
+            with profiler.phase('render'):
+                self.render()
+        with profiler.phase('physics'):
+            if self.physics == 'numpy':
+                self.space.step(1 / fps)
+                self.hit_obstacle = self.space.hit_obstacle
+                self.hit_wall = self.space.hit_wall
+                self.touch_goal = self.space.reach_goal
+            else:
+                self.hit_obstacle = self.hit_wall = self.touch_goal = False
+                self.space.step(1 / fps)
+        if self.crowd is not None:
+            with profiler.phase('crowd'):
+                self.crowd.step(1 / fps, self.robot_body.position, robot_radius)
+        if draw:
+            with profiler.phase('render'):
+                import pygame
+                pygame.display.flip()
+                if self.realtime:
+                    clock.tick(self.display_fps)
+
+
+class GamePool:
+    """
+    Idle GameClass environments, grouped by their constructor arguments.
+    acquire() resets and returns an idle one if there is one, else builds
+    it; release() makes it available again. Episodes then reuse the same
+    spaces instead of building new ones and leaving the old ones to the
+    garbage collector.
+    """
+    def __init__(self):
+        self.idle = {}
+
+    def acquire(self, seed=None, **kwargs):
+        key = tuple(sorted(kwargs.items()))
+        if self.idle.get(key):
+            game = self.idle[key].pop()
+            game.reset(seed)
+        else:
+            if seed is not None:
+                random.seed(seed)
+            game = GameClass(**kwargs)
+            game.pool_key = key
+        return game
+
+    def release(self, game):
+        self.idle.setdefault(game.pool_key, []).append(game)
+
+    def __len__(self):
+        return sum(len(games) for games in self.idle.values())
 
 
 if __name__ == "__main__":
 
     game_class = GameClass(draw_screen = True, display_path = True, fps = 30)
     
+    import pygame
+
     # Game loop
     while game_class.exit == 0:
             reward, state = game_class.frame_step(random.randint(0, 2))
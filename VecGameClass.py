@@ -0,0 +1,174 @@
+"""
+Step several independent GameClass environments together, so one forward
+pass of the network can choose the actions of all of them.
+"""
+
+import random
+import multiprocessing as mp
+import numpy as np
+
+from GameClass import GameClass
+
+
+def env_worker(conn, num_envs, fps, max_steps, seed, physics, num_pedestrians, action_repeat,
+               lidar_beams):
+    """Run a slice of the environments in a child process"""
+    random.seed(seed)
+    venv = VecGameClass(num_envs, fps, max_steps, physics=physics,
+                        num_pedestrians=num_pedestrians, action_repeat=action_repeat,
+                        lidar_beams=lidar_beams)
+    while True:
+        cmd, data = conn.recv()
+        if cmd == 'step':
+            conn.send(venv.step(data))
+        elif cmd == 'reset_done':
+            conn.send(venv.reset_done(data))
+        elif cmd == 'reset':
+            conn.send(venv.reset())
+        elif cmd == 'close':
+            conn.close()
+            break
+
+
+class VecGameClass:
+    def __init__(self, num_envs, fps, max_steps=None, num_workers=0, seed=None,
+                 physics='pymunk', num_pedestrians=0, action_repeat=1, lidar_beams=0):
+        """
+        num_envs: number of independent environments.
+        max_steps: the episode of an environment is done after this many
+            frames, even if it didn't reach the goal.
+        num_workers: if > 0, the environments are spread over this many
+            processes so they are stepped on several cores.
+        physics: the GameClass physics backend, 'pymunk' or 'numpy'.
+        num_pedestrians: moving pedestrians in every environment.
+        action_repeat: physics steps per step(), max_steps counts physics
+            steps.
+        lidar_beams: lidar beams appended to the states.
+        """
+        self.num_envs = num_envs
+        self.fps = fps
+        self.max_steps = max_steps
+        self.num_workers = num_workers
+        self.physics = physics
+        self.num_pedestrians = num_pedestrians
+        self.action_repeat = action_repeat
+        self.lidar_beams = lidar_beams
+        self.state_dim = (3 if num_pedestrians == 0 else 5) + lidar_beams
+
+        if num_workers > 0:
+            self.slices = np.array_split(np.arange(num_envs), num_workers)
+            self.conns = []
+            self.workers = []
+            for i, s in enumerate(self.slices):
+                parent, child = mp.Pipe()
+                worker_seed = None if seed is None else seed + i
+                worker = mp.Process(target=env_worker,
+                                    args=(child, len(s), fps, max_steps, worker_seed, physics,
+                                          num_pedestrians, action_repeat, lidar_beams))
+                worker.daemon = True
+                worker.start()
+                child.close()
+                self.conns.append(parent)
+                self.workers.append(worker)
+        else:
+            if seed is not None:
+                random.seed(seed)
+            self.envs = [None] * num_envs
+
+        self.states = np.zeros((num_envs, self.state_dim))
+        # Environments whose episode ended, until they are reset
+        self.done = np.zeros(num_envs, dtype=bool)
+        self.reset()
+
+    def make_env(self, i):
+        """
+        Build a headless environment, or reset the one which ended, and
+        return its initial state
+        """
+        if self.envs[i] is not None:
+            self.envs[i].reset()
+        else:
+            self.envs[i] = GameClass(draw_screen = False, display_path = False, fps = self.fps,
+                                     physics = self.physics, num_pedestrians = self.num_pedestrians,
+                                     action_repeat = self.action_repeat,
+                                     lidar_beams = self.lidar_beams)
+        # Choose no action in the initial frame
+        _, state = self.envs[i].frame_step(2)
+        return state
+
+    def reset(self):
+        """Restart every environment, return the (N, state_dim) states"""
+        if self.num_workers > 0:
+            for conn in self.conns:
+                conn.send(('reset', None))
+            self.states = np.vstack([conn.recv() for conn in self.conns])
+        else:
+            for i in range(self.num_envs):
+                self.states[i] = self.make_env(i)
+        self.done[:] = False
+        return self.states
+
+    def step(self, actions):
+        """
+        Apply one action per environment.
+        Return the (N, state_dim) new states, (N,) rewards and (N,) done flags.
+        Done environments are not stepped again until reset_done(): they
+        keep returning their terminal state, reward 0 and done.
+        """
+        actions = np.asarray(actions)
+        if self.num_workers > 0:
+            for conn, s in zip(self.conns, self.slices):
+                conn.send(('step', actions[s]))
+            results = [conn.recv() for conn in self.conns]
+            states = np.vstack([r[0] for r in results])
+            rewards = np.hstack([r[1] for r in results])
+            dones = np.hstack([r[2] for r in results])
+            self.states = states
+            return states, rewards, dones
+
+        rewards = np.zeros(self.num_envs)
+        for i, env in enumerate(self.envs):
+            if self.done[i]:
+                continue
+            rewards[i], self.states[i] = env.frame_step(actions[i])
+            self.done[i] = env.exit or (self.max_steps is not None and
+                                        env.num_steps >= self.max_steps)
+        return self.states.copy(), rewards, self.done.copy()
+
+    def reset_done(self, dones):
+        """Restart the environments flagged in dones, return all states"""
+        dones = np.asarray(dones)
+        if self.num_workers > 0:
+            for conn, s in zip(self.conns, self.slices):
+                conn.send(('reset_done', dones[s]))
+            self.states = np.vstack([conn.recv() for conn in self.conns])
+            return self.states
+
+        for i in np.flatnonzero(dones):
+            self.states[i] = self.make_env(i)
+            self.done[i] = False
+        return self.states
+
+    def close(self):
+        if self.num_workers > 0:
+            for conn in self.conns:
+                conn.send(('close', None))
+            for worker in self.workers:
+                worker.join()
+
+
+if __name__ == "__main__":
+    import time
+
+    num_envs = 16
+    vec_game = VecGameClass(num_envs, fps = 60, max_steps = 4000, num_workers = 4)
+    start = time.time()
+    frames = 500
+    for t in range(frames):
+        actions = np.random.randint(0, 3, num_envs)
+        states, rewards, dones = vec_game.step(actions)
+        if dones.any():
+            vec_game.reset_done(dones)
+    elapsed = time.time() - start
+    print("%d envs, %.0f env steps/s" % (num_envs, num_envs * frames / elapsed))
+    vec_game.close()
@@ -0,0 +1,258 @@
+"""
+Asynchronous actor-learner training.
+
+Actor processes each step a VecGameClass, choose the actions with a NumPy
+copy of the network and send their transitions to the learner through a
+queue. The learner, the main process, moves them into its ReplayMemory
+and trains the Keras model without waiting for the games. Every
+PUBLISH_EVERY training steps it writes its weights to shared memory,
+where the actors pick them up. Simulation throughput grows with the
+number of actors while the learner keeps its own core(s).
+"""
+
+import time
+import queue
+import multiprocessing as mp
+import numpy as np
+
+from VecGameClass import VecGameClass
+from inference import NumpyModel, dense_layers
+from qvalues import choose_actions
+from replay import ReplayMemory
+from metrics import MetricsWriter, read_metrics
+
+# Actor processes and the environments each of them steps
+ACTORS = 3
+ENVS_PER_ACTOR = 8
+# Vector steps an actor collects before sending them in one message
+SEND_EVERY = 16
+# Training steps of the learner, and between two weight publications
+TRAIN_STEPS = 28000
+PUBLISH_EVERY = 100
+# Save the model every this many training steps
+SAVE_EVERY = 4000
+# Transitions in the replay before the learner starts
+LEARN_START = 12000
+# Frames of an actor over which epsilon decays from 1 to 0.1, counted
+# from the first published weights
+EXPLORE_FRAMES = 28000
+# An episode ends after this many frames even without reaching the goal
+FRAMES = 4000
+
+
+class SharedWeights:
+    """Float32 network weights in shared memory, with a version number"""
+    def __init__(self, ctx, weights):
+        self.shapes = [np.shape(w) for w in weights]
+        self.array = ctx.Array('f', sum(int(np.size(w)) for w in weights))
+        self.version = ctx.Value('i', 0, lock=False)
+        self.publish(weights)
+
+    def publish(self, weights):
+        flat = np.concatenate([np.ravel(w) for w in weights])
+        with self.array.get_lock():
+            np.frombuffer(self.array.get_obj(), dtype=np.float32)[:] = flat
+            self.version.value += 1
+
+    def read(self):
+        """Return the version and a copy of the weights"""
+        with self.array.get_lock():
+            flat = np.frombuffer(self.array.get_obj(), dtype=np.float32).copy()
+            version = self.version.value
+        weights = []
+        start = 0
+        for shape in self.shapes:
+            size = int(np.prod(shape))
+            weights.append(flat[start:start + size].reshape(shape))
+            start += size
+        return version, weights
+
+
+def run_actor(actor_id, transitions, weights, stop, activation_names, game):
+    """
+    Step the games of one actor until the learner sets stop. Every
+    SEND_EVERY steps, put ((states, actions, rewards, states_new),
+    (frames, episodes, path lengths of the episodes which reached the
+    goal)) on the transitions queue.
+    """
+    seed = game['seed'] + 1000 * actor_id
+    np.random.seed(seed)
+    version, w = weights.read()
+    model = NumpyModel(w[0::2], w[1::2], activation_names)
+    first_version = version
+    games = VecGameClass(game['envs'], game['fps'], FRAMES, seed=seed,
+                         physics=game['physics'], num_pedestrians=game['num_pedestrians'],
+                         action_repeat=game['action_repeat'], lidar_beams=game['lidar_beams'])
+    states = games.states.copy()
+
+    frames = 0
+    learned_frames = 0
+    batch = []
+    episodes = 0
+    paths = []
+    while not stop.is_set():
+        # Pick up the newest weights of the learner
+        if weights.version.value != version:
+            version, w = weights.read()
+            model.set_weights(w)
+
+        # Random actions until the learner published, then epsilon greedy
+        if version == first_version:
+            actions = np.random.randint(0, 3, len(states))
+        else:
+            epsilon = max(0.1, 1. - 0.9 * learned_frames / EXPLORE_FRAMES)
+            actions = choose_actions(model, states, epsilon)
+            learned_frames += len(states)
+
+        states_new, rewards, dones = games.step(actions)
+        batch.append((states, actions, rewards, states_new))
+        frames += len(states)
+        if dones.any():
+            episodes += dones.sum()
+            paths.extend(games.envs[i].num_steps for i in np.flatnonzero(rewards > 8000))
+            states_new = games.reset_done(dones).copy()
+        states = states_new
+
+        if len(batch) == SEND_EVERY:
+            item = (tuple(np.concatenate(column) for column in zip(*batch)),
+                    (frames, int(episodes), paths))
+            # Don't block forever on a full queue once the learner stopped
+            while not stop.is_set():
+                try:
+                    transitions.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            batch = []
+            frames = episodes = 0
+            paths = []
+
+    # Unsent data may be dropped, the learner is done
+    transitions.cancel_join_thread()
+    games.close()
+
+
+def train_async(model, params, num_actors=ACTORS, envs_per_actor=ENVS_PER_ACTOR,
+                train_steps=TRAIN_STEPS, publish_every=PUBLISH_EVERY, seed=0):
+    """
+    Train model like trainning.train, with num_actors actor processes
+    playing the games. Return the same summary dict, plus the throughputs.
+    """
+    import trainning
+
+    filename = trainning.params_to_filename(params) + '-async'
+    batchSize = params['batchSize']
+    replay = ReplayMemory(params['buffer'], trainning.NUM_INPUT - 3,
+                          prioritized = params.get('prioritized', False))
+    learn_start = max(LEARN_START, batchSize)
+    target_sync = params.get('target_sync', 0)
+    target = NumpyModel.from_keras(model) if target_sync else None
+
+    ctx = mp.get_context('spawn')
+    _, _, activation_names = dense_layers(model.get_config(), model.get_weights())
+    weights = SharedWeights(ctx, model.get_weights())
+    transitions = ctx.Queue(maxsize=4 * num_actors)
+    stop = ctx.Event()
+    game = {
+        'envs': envs_per_actor,
+        'fps': trainning.FPS,
+        'physics': trainning.PHYSICS,
+        'num_pedestrians': trainning.PEDESTRIANS,
+        'action_repeat': trainning.ACTION_REPEAT,
+        'lidar_beams': trainning.LIDAR_BEAMS,
+        'seed': seed,
+    }
+    actors = [ctx.Process(target=run_actor,
+                          args=(i, transitions, weights, stop, activation_names, game))
+              for i in range(num_actors)]
+    for actor in actors:
+        actor.daemon = True
+        actor.start()
+
+    frames = 0
+    episodes = 0
+    path_log = []
+    # One record per training step, and one per episode reaching the goal
+    metrics = MetricsWriter(trainning.metrics_path(filename))
+    checkpoints = trainning.checkpoint_writer()
+    step = 0
+    start = time.time()
+    try:
+        while step < train_steps:
+            # Move what the actors sent to the replay, and wait for more
+            # while it's too small to learn from
+            while True:
+                waiting = len(replay) < learn_start
+                try:
+                    (states, actions, rewards, states_new), (f, e, paths) = \
+                        transitions.get(waiting, 1.)
+                except queue.Empty:
+                    if not waiting:
+                        break
+                    if not any(actor.is_alive() for actor in actors):
+                        raise RuntimeError("All actor processes died")
+                    continue
+                replay.add_batch(states, actions, rewards, states_new)
+                frames += f
+                for k, p in enumerate(paths):
+                    path_log.append([episodes + k, p])
+                    metrics.write(frame = frames, episode = episodes + k, path_length = p)
+                episodes += e
+
+            train_start = time.time()
+            loss = trainning.learn(model, replay, batchSize, target)
+            step += 1
+            metrics.write(frame = frames, episode = episodes, loss = loss,
+                          train_time = time.time() - train_start)
+
+            if step % publish_every == 0:
+                weights.publish(model.get_weights())
+            if target is not None and step % target_sync == 0:
+                trainning.sync_target(target, model, replay)
+            if step % SAVE_EVERY == 0:
+                trainning.save_checkpoint(model, checkpoints, filename, step // SAVE_EVERY)
+                print("Step %d, %d frames, %d episodes, %d goals" %
+                      (step, frames, episodes, len(path_log)))
+    finally:
+        stop.set()
+        # Keep draining so no actor stays blocked on a full queue
+        for actor in actors:
+            while actor.is_alive():
+                try:
+                    transitions.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+                actor.join(0.1)
+        metrics.close()
+        checkpoints.close()
+    seconds = time.time() - start
+
+    losses = read_metrics(trainning.metrics_path(filename))['loss']
+    losses = losses[~np.isnan(losses)]
+    trainning.log_results(filename, path_log, losses, step // SAVE_EVERY)
+    return {
+        'episodes': episodes,
+        'frames': frames,
+        'goals': len(path_log),
+        'mean_path': float(np.mean([p for _, p in path_log])) if path_log else float('nan'),
+        'final_loss': float(np.mean(losses[-1000:])) if len(losses) else float('nan'),
+        'frames_per_second': frames / seconds,
+        'train_steps_per_second': step / seconds,
+    }
+
+
+if __name__ == "__main__":
+    # Only the learner imports Keras, the spawned actors import this
+    # module as __mp_main__ and skip this block.
+    import trainning
+
+    params = {
+        "batchSize": 100,
+        "buffer": 10000,
+        "nn": [256, 256]
+    }
+    model = trainning.build_model(params)
+    summary = train_async(model, params)
+    print("%d frames (%.0f/s), %d training steps (%.1f/s), %d goals" %
+          (summary['frames'], summary['frames_per_second'], TRAIN_STEPS,
+           summary['train_steps_per_second'], summary['goals']))
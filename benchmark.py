@@ -0,0 +1,323 @@
+"""
+Benchmark suite for the simulation, inference and training steps.
+
+Every benchmark is timed with fixed seeds and the best of REPEAT runs, and
+stored as seconds per operation under a dotted name in a JSON file. With
+a baseline, every shared name is compared and the ones slower than the
+tolerance are reported as regressions (exit status 1):
+
+    python benchmark.py --save-baseline          # on the reference commit
+    python benchmark.py                          # later, compare against it
+    python benchmark.py --only frame_step,replay --quick
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import random
+import timeit
+import platform
+import subprocess
+import numpy as np
+
+from util import atomic_write
+
+RESULTS_DIR = 'results/benchmarks'
+BASELINE = os.path.join(RESULTS_DIR, 'baseline.json')
+LATEST = os.path.join(RESULTS_DIR, 'latest.json')
+# Runs of every benchmark, the fastest one is kept
+REPEAT = 5
+# A benchmark more than this much slower than the baseline is a regression
+TOLERANCE = 0.25
+
+
+def measure(fn, number, repeat=REPEAT):
+    """Best seconds per call of fn, over repeat runs of number calls"""
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def stepper(game, seed=0):
+    """A function playing the next action of a fixed random sequence"""
+    actions = np.random.RandomState(seed).randint(0, 3, 100000).tolist()
+    actions.reverse()
+    return lambda: game.frame_step(actions.pop())
+
+
+def bench_frame_step(scale):
+    """GameClass.frame_step, headless with both physics and rendered"""
+    from GameClass import GameClass
+
+    results = {}
+    frames = int(2000 * scale)
+    for physics in ['pymunk', 'numpy']:
+        random.seed(0)
+        game = GameClass(draw_screen = False, display_path = False, fps = 60, physics = physics)
+        results['frame_step.headless.' + physics] = measure(stepper(game), frames)
+
+    random.seed(0)
+    game = GameClass(draw_screen = True, display_path = True, fps = 60, realtime = False)
+    results['frame_step.rendered.pymunk'] = measure(stepper(game), int(200 * scale))
+    return results
+
+
+def bench_sensors(scale):
+    """
+    Sensor and lidar readings and a physics step plus contact checks, by
+    obstacle count, and with 1000 obstacles, with and without the spatial
+    index (the '.index' names)
+    """
+    from GameClass import GameClass, lidar_range
+
+    results = {}
+    for n in [10, 100, 1000]:
+        for physics in ['pymunk', 'numpy']:
+            random.seed(0)
+            game = GameClass(draw_screen = False, display_path = False, fps = 60,
+                             physics = physics, num_obstacles = n, lidar_beams = 64)
+            results['sensors.%d.%s' % (n, physics)] = measure(game.get_sensor_data, int(2000 * scale))
+            results['lidar.64.%d.%s' % (n, physics)] = measure(game.get_lidar_data, int(2000 * scale))
+
+            def physics_step():
+                game.update(60)
+                game.check_hit_obstacle()
+                game.check_hit_wall()
+                game.check_reach_goal()
+            results['collisions.%d.%s' % (n, physics)] = measure(physics_step, int(1000 * scale))
+
+    # The spatial index serves the sensor readings within a range, and the
+    # contact search of the numpy physics, from spatial.INDEX_MIN shapes
+    for physics in ['pymunk', 'numpy']:
+        for spatial_index in [False, True]:
+            random.seed(0)
+            game = GameClass(draw_screen = False, display_path = False, fps = 60,
+                             physics = physics, num_obstacles = 1000,
+                             spatial_index = spatial_index)
+            name = '1000.%s%s' % (physics, '.index' if spatial_index else '')
+            results['sensors.range.' + name] = measure(
+                lambda: game.get_sensor_data(lidar_range), int(2000 * scale))
+            if physics == 'numpy':
+                results['contacts.' + name] = measure(
+                    lambda: game.space.find_contacts(*game.robot_body.position), int(2000 * scale))
+    return results
+
+
+def latest_checkpoints():
+    """The last saved checkpoint of each network size"""
+    checkpoints = {}
+    paths = glob.glob('saved-models/model_nn-*.h5') + glob.glob('saved-models/model_nn-*.npz')
+    for path in sorted(paths, key=lambda p: int(p.rsplit('-', 1)[1].split('.')[0])):
+        checkpoints[os.path.basename(path).split('-')[1]] = path
+    return checkpoints
+
+
+def bench_predict(scale):
+    """Q values of 1 and of a batch of states for the saved models"""
+    from inference import load_model
+    from qvalues import predict_q
+
+    results = {}
+    rng = np.random.RandomState(0)
+    for size, path in sorted(latest_checkpoints().items(), key=lambda item: int(item[0])):
+        model = load_model(path)
+        for batch in [1, 100, 1000]:
+            states = rng.uniform(0, 900, (batch, 3))
+            results['predict.numpy.%s.%d' % (size, batch)] = measure(
+                lambda: predict_q(model, states), max(1, int(2000 * scale / batch)))
+
+        # A weights-only checkpoint has no Keras model to load
+        if path.endswith('.npz'):
+            continue
+        try:
+            from keras.models import load_model as keras_load_model
+        except ImportError:
+            continue
+        model = keras_load_model(path)
+        for batch in [1, 100, 1000]:
+            states = rng.uniform(0, 900, (batch, 3))
+            results['predict.keras.%s.%d' % (size, batch)] = measure(
+                lambda: predict_q(model, states), max(1, int(200 * scale / batch)))
+    return results
+
+
+def bench_train_step(scale):
+    """Minibatch sampling, process_minibatch and fit of one training step"""
+    import trainning
+    from replay import ReplayMemory
+    from inference import NumpyModel
+
+    results = {}
+    rng = np.random.RandomState(0)
+    for size in [128, 256, 512]:
+        params = {"batchSize": 100, "buffer": 10000, "nn": [size, size]}
+        model = trainning.build_model(params)
+        replay = ReplayMemory(params['buffer'], trainning.NUM_INPUT - 3)
+        for t in range(params['buffer']):
+            replay.add(rng.uniform(0, 900, 3), rng.randint(3), -1., rng.uniform(0, 900, 3))
+
+        def process():
+            minibatch, indices, weights = replay.sample(params['batchSize'])
+            return trainning.process_minibatch(minibatch, model, params['batchSize'])
+
+        def train_step():
+            X_train, y_train = process()
+            model.fit(X_train, y_train, batch_size=params['batchSize'], verbose=0)
+
+        # The same step without fit's setup, as trainning.learn does it
+        def train_on_batch():
+            X_train, y_train = process()
+            model.train_on_batch(X_train, y_train)
+
+        # With a target network synced every 1000 steps, most of the max Q
+        # values come from the replay's cache once it is warm
+        target = NumpyModel.from_keras(model)
+        steps = [0]
+
+        def process_target():
+            minibatch, indices, weights = replay.sample(params['batchSize'])
+            if steps[0] % 1000 == 0:
+                trainning.sync_target(target, model, replay)
+            steps[0] += 1
+            max_q = trainning.target_max_q(replay, indices, target)
+            return trainning.process_minibatch(minibatch, model, params['batchSize'], max_q)
+
+        results['process_minibatch.%d' % size] = measure(process, int(100 * scale))
+        results['process_minibatch.target.%d' % size] = measure(process_target, int(1000 * scale))
+        results['train_step.%d' % size] = measure(train_step, int(100 * scale))
+        results['train_on_batch.%d' % size] = measure(train_on_batch, int(100 * scale))
+    return results
+
+
+def bench_replay(scale):
+    """Storing one transition and sampling a minibatch from a full replay"""
+    from replay import ReplayMemory
+
+    results = {}
+    state = np.zeros(3)
+    for prioritized in [False, True]:
+        name = 'prioritized' if prioritized else 'uniform'
+        memory = ReplayMemory(100000, 3, prioritized=prioritized)
+        memory.rng = np.random.default_rng(0)
+        for t in range(memory.capacity):
+            memory.add(state, 2, -1., state)
+        results['replay.add.' + name] = measure(lambda: memory.add(state, 2, -1., state),
+                                                int(10000 * scale))
+        results['replay.sample.' + name] = measure(lambda: memory.sample(100), int(2000 * scale))
+    return results
+
+
+BENCHMARKS = {
+    'frame_step': bench_frame_step,
+    'sensors': bench_sensors,
+    'predict': bench_predict,
+    'train_step': bench_train_step,
+    'replay': bench_replay,
+}
+
+
+def environment():
+    """What the numbers depend on besides the code"""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def run(names, scale=1.):
+    """Run the named benchmarks, return the results document"""
+    results = {}
+    skipped = {}
+    for name in names:
+        try:
+            results.update(BENCHMARKS[name](scale))
+        except ImportError as e:
+            # e.g. the training step without Keras
+            skipped[name] = str(e)
+    return {'environment': environment(), 'results': results, 'skipped': skipped}
+
+
+def compare(current, baseline, tolerance=TOLERANCE):
+    """
+    Rows (name, baseline seconds, current seconds, ratio) of the shared
+    benchmarks, and the names of the regressions.
+    """
+    rows = []
+    regressions = []
+    for name in sorted(current['results']):
+        if name not in baseline['results']:
+            continue
+        base = baseline['results'][name]
+        new = current['results'][name]
+        ratio = new / base if base > 0 else float('inf')
+        rows.append((name, base, new, ratio))
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return rows, regressions
+
+
+def save(document, path):
+    with atomic_write(path) as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+
+def format_seconds(seconds):
+    if seconds < 1e-3:
+        return '%.1fus' % (seconds * 1e6)
+    return '%.2fms' % (seconds * 1e3)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time the simulation, inference and training steps")
+    parser.add_argument('--only', default=','.join(BENCHMARKS),
+                        help='comma separated benchmarks among ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--quick', action='store_true', help='10x fewer iterations')
+    parser.add_argument('--output', default=LATEST)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    # Rendering is timed without opening a window
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+    document = run(args.only.split(','), 0.1 if args.quick else 1.)
+    save(document, args.output)
+    for name, reason in document['skipped'].items():
+        print("skipped %s: %s" % (name, reason))
+
+    if args.save_baseline:
+        save(document, args.baseline)
+        for name, seconds in sorted(document['results'].items()):
+            print("%-36s %10s" % (name, format_seconds(seconds)))
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        for name, seconds in sorted(document['results'].items()):
+            print("%-36s %10s" % (name, format_seconds(seconds)))
+        print("No baseline at %s, store one with --save-baseline" % args.baseline)
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows, regressions = compare(document, baseline, args.tolerance)
+    for name, base, new, ratio in rows:
+        print("%-36s %10s %10s  %5.2fx%s" % (name, format_seconds(base), format_seconds(new),
+                                           ratio, '  REGRESSION' if name in regressions else ''))
+    if regressions:
+        print("%d regressions against %s (commit %s)" %
+              (len(regressions), args.baseline, baseline['environment'].get('commit')))
+        sys.exit(1)
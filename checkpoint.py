@@ -0,0 +1,130 @@
+"""
+Compact weights-only checkpoints, written in the background.
+
+model.save() serializes the whole Keras model with its optimizer state
+while training waits for it. A CheckpointWriter only copies the weights
+in memory, and a thread writes them to a .npz file holding:
+
+    config      JSON of model.get_config(), for inference.dense_layers
+    w0, w1...   the arrays of model.get_weights(), float32 or float16
+
+Files are written aside and renamed over the target, so a reader sees
+the previous checkpoint or the new one, never a partial file.
+inference.load_model reads them into a NumpyModel without Keras or an
+optimizer; a Keras model built by trainning.build_model takes the weights
+of load_weights with set_weights.
+
+Existing .h5 checkpoints are converted with:
+
+    python checkpoint.py saved-models/*.h5 [--float16]
+"""
+
+import os
+import json
+import queue
+import threading
+import numpy as np
+
+from util import atomic_path, atomic_write
+
+
+def save_weights(path, config, weights, dtype=np.float32):
+    """Write a checkpoint atomically"""
+    arrays = {'w%d' % i: np.asarray(w).astype(dtype) for i, w in enumerate(weights)}
+    with atomic_write(path, 'wb') as f:
+        np.savez(f, config=np.array(json.dumps(config)), **arrays)
+
+
+def save_model(model, path):
+    """Write model.save() atomically"""
+    with atomic_path(path) as tmp:
+        model.save(tmp, overwrite=True)
+
+
+def load_weights(path):
+    """The model config and the float32 weights of a checkpoint"""
+    with np.load(path) as data:
+        config = json.loads(str(data['config']))
+        num = sum(1 for name in data.files if name != 'config')
+        weights = [data['w%d' % i].astype(np.float32) for i in range(num)]
+    return config, weights
+
+
+class CheckpointWriter:
+    def __init__(self, dtype=np.float32, max_pending=2):
+        """
+        dtype: storage type of the weights, np.float16 halves the files.
+        max_pending: checkpoints waiting to be written before save()
+            blocks, which bounds the memory held by the copies.
+        """
+        self.dtype = dtype
+        self.pending = queue.Queue(max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save(self, model, path):
+        """
+        Copy the weights of model now, write them to path in the
+        background. A .h5 path is saved by model.save() before returning:
+        it reads the live model layer by layer, which training must not
+        update meanwhile.
+        """
+        self.check()
+        if path.endswith('.h5'):
+            save_model(model, path)
+            return
+        weights = [np.array(w, copy=True) for w in model.get_weights()]
+        self.pending.put((path, model.get_config(), weights))
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            try:
+                if item is None:
+                    return
+                save_weights(*item, dtype=self.dtype)
+            except Exception as e:
+                # Raised in the training thread by the next call
+                self.error = e
+            finally:
+                self.pending.task_done()
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def flush(self):
+        """Wait until every checkpoint saved so far is written"""
+        self.pending.join()
+        self.check()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.pending.put(None)
+            self.thread.join()
+        self.check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    from inference import read_h5
+
+    parser = argparse.ArgumentParser(description="Convert .h5 checkpoints to weights-only .npz")
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--float16', action='store_true')
+    args = parser.parse_args()
+
+    for path in args.paths:
+        out = os.path.splitext(path)[0] + '.npz'
+        config, weights = read_h5(path)
+        save_weights(out, config, weights, np.float16 if args.float16 else np.float32)
+        print("%s: %dKB -> %s: %dKB" % (path, os.path.getsize(path) // 1024,
+                                         out, os.path.getsize(out) // 1024))
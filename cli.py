@@ -0,0 +1,141 @@
+"""
+One command line for training, sweeps, playing, evaluating and plotting:
+
+    python cli.py train [--nn 256 256] [--headless] [--physics numpy] [--actors 4]
+    python cli.py sweep [--workers 4] [--nn 128 256]
+    python cli.py play saved-models/model_nn-128-128-100-10000-7.h5 [--seed 1] [--headless]
+    python cli.py eval 'saved-models/*.h5' [--scenarios 10]
+    python cli.py plot [results/logs]
+
+The settings edited as module globals before (TUNING, FPS, DRAW_SCREEN,
+the checkpoint of testing.py...) are arguments. Every subcommand imports
+its modules when it runs, and these only import pygame, pymunk and Keras
+where they are used: plotting and evaluating never load Keras, and a
+headless game with NumPy physics loads neither pygame nor pymunk.
+"""
+
+import argparse
+
+
+def train(args):
+    import trainning
+    from actor_learner import train_async
+
+    trainning.DRAW_SCREEN = not args.headless
+    trainning.FPS = args.fps
+    trainning.PHYSICS = args.physics
+    trainning.PEDESTRIANS = args.pedestrians
+    trainning.LIDAR_BEAMS = args.lidar_beams
+    trainning.NUM_INPUT = trainning.num_inputs(args.pedestrians, args.lidar_beams)
+    trainning.ACTION_REPEAT = args.action_repeat
+    trainning.CHECKPOINT_FORMAT = args.checkpoint_format
+    trainning.PROFILE = args.profile
+
+    params = {
+        "batchSize": args.batch_size,
+        "buffer": args.buffer,
+        "nn": args.nn,
+    }
+    # Only the options given, so the filenames of the defaults don't change
+    for name in ['prioritized', 'multi_head', 'numpy_actor', 'target_sync',
+                 'train_every', 'gradient_steps']:
+        if getattr(args, name):
+            params[name] = getattr(args, name)
+
+    model = trainning.build_model(params)
+    if args.actors > 0:
+        summary = train_async(model, params, num_actors = args.actors)
+    else:
+        summary = trainning.train(model, params)
+    print(summary)
+
+
+def play(args):
+    import testing
+    from inference import load_model
+
+    testing.FPS = args.fps
+    model = load_model(args.checkpoint)
+    path_length = testing.play(model, args.seed, draw_screen = not args.headless,
+                               record = args.record, max_frames = args.max_frames)
+    print("Path length: %d frames" % path_length)
+
+
+def sweep(args):
+    import sweep
+    sweep.main(args)
+
+
+def evaluate(args):
+    import evaluation
+    evaluation.main(args)
+
+
+def plot(args):
+    import plotting
+    plotting.main(args)
+
+
+def build_parser():
+    # The defaults are written here rather than read from the modules,
+    # which would import them
+    parser = argparse.ArgumentParser(description="Robot navigation in crowds")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    p = commands.add_parser('train', help='train a model')
+    p.add_argument('--nn', type=int, nargs=2, default=[256, 256], help='units of the hidden layers')
+    p.add_argument('--batch-size', type=int, default=100)
+    p.add_argument('--buffer', type=int, default=10000)
+    p.add_argument('--prioritized', action='store_true', help='prioritized replay')
+    p.add_argument('--multi-head', action='store_true',
+                   help='one network output per action')
+    p.add_argument('--numpy-actor', action='store_true',
+                   help='choose actions with a NumPy copy of the model')
+    p.add_argument('--target-sync', type=int, default=0,
+                   help='training steps between target network syncs, 0 for no target')
+    p.add_argument('--train-every', type=int, default=0, help='frames between updates')
+    p.add_argument('--gradient-steps', type=int, default=0, help='training steps per update')
+    p.add_argument('--actors', type=int, default=0, help='actor processes playing the games')
+    p.add_argument('--headless', action='store_true', help='no window')
+    p.add_argument('--fps', type=int, default=60)
+    p.add_argument('--physics', default='pymunk', choices=['pymunk', 'numpy'])
+    p.add_argument('--pedestrians', type=int, default=0)
+    p.add_argument('--lidar-beams', type=int, default=0)
+    p.add_argument('--action-repeat', type=int, default=1)
+    p.add_argument('--checkpoint-format', default='npz', choices=['npz', 'h5'])
+    p.add_argument('--profile', action='store_true', help='print the time of each phase')
+    p.set_defaults(run=train)
+
+    p = commands.add_parser('sweep', help='train a grid of parameters')
+    add_module_arguments(p, 'sweep')
+    p.set_defaults(run=sweep)
+
+    p = commands.add_parser('play', help='play an episode with a checkpoint')
+    p.add_argument('checkpoint', help='.h5 or .npz checkpoint')
+    p.add_argument('--seed', type=int, default=None)
+    p.add_argument('--headless', action='store_true', help='no window')
+    p.add_argument('--record', default=None, help='save the episode to this .npz for video.py')
+    p.add_argument('--max-frames', type=int, default=None)
+    p.add_argument('--fps', type=int, default=60)
+    p.set_defaults(run=play)
+
+    p = commands.add_parser('eval', help='evaluate checkpoints on seeded scenarios')
+    add_module_arguments(p, 'evaluation')
+    p.set_defaults(run=evaluate)
+
+    p = commands.add_parser('plot', help='plot the training logs')
+    add_module_arguments(p, 'plotting')
+    p.set_defaults(run=plot)
+    return parser
+
+
+def add_module_arguments(parser, module):
+    # sweep, evaluation and plotting only import the standard library,
+    # NumPy and metrics at the top
+    __import__(module).add_arguments(parser)
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    args.run(args)
@@ -0,0 +1,229 @@
+"""
+Moving pedestrians driven by the social force model (Helbing and Molnar,
+Social force model for pedestrian dynamics, 1995).
+
+Every pedestrian accelerates towards its own goal and is pushed away by
+the other pedestrians, the walls, the static obstacles and the robot.
+The whole crowd is stored in (N, 2) NumPy arrays and stepped at once;
+pedestrian pairs are found with a cell list, so a step costs about
+O(N) instead of O(N^2).
+"""
+
+import math
+import numpy as np
+
+# Social force parameters, in pixels and seconds
+relaxation_time = 0.5
+# Strength and range of the repulsion between two pedestrians
+ped_strength = 1000.
+ped_range = 15.
+# Strength and range of the repulsion of walls, obstacles and the robot
+wall_strength = 1000.
+wall_range = 10.
+# Forces are ignored beyond this many ranges from the other body's edge
+cutoff_ranges = 5.
+
+
+class Crowd:
+    def __init__(self, num, width, height, radius=15, speed=80.,
+                 obstacles=None, obstacle_radius=0., rng=None):
+        """
+        num: number of pedestrians, spawned at random positions.
+        width, height: the walkable area, walls are on its edges.
+        radius, speed: body radius and mean preferred walking speed.
+        obstacles: (M, 2) centers of static circle obstacles.
+        rng: a np.random.RandomState, so episodes can be reproduced.
+        """
+        self.num = num
+        self.width = width
+        self.height = height
+        self.radius = float(radius)
+        self.speed = speed
+        self.obstacle_radius = float(obstacle_radius)
+        self.obstacles = np.zeros((0, 2))
+        self.velocities = np.zeros((num, 2))
+        self.reset(rng if rng is not None else np.random.RandomState(), obstacles)
+
+        # Pedestrians closer than this interact
+        self.cutoff = 2 * self.radius + cutoff_ranges * ped_range
+
+    def reset(self, rng=None, obstacles=None):
+        """
+        Spawn the pedestrians again at rest, with new goals and speeds.
+        rng and obstacles replace the current ones if given.
+        """
+        if rng is not None:
+            self.rng = rng
+        if obstacles is not None:
+            self.obstacles = np.asarray(obstacles, dtype=float)
+
+        speed = self.speed
+        self.positions = self.random_points(self.num)
+        self.velocities[:] = 0.
+        self.goals = self.random_points(self.num)
+        # Preferred speeds are spread around the mean, max speed is 1.3x
+        self.speeds = self.rng.normal(speed, 0.1 * speed, self.num).clip(0.5 * speed, 1.5 * speed)
+        self.max_speeds = 1.3 * self.speeds
+
+    def __len__(self):
+        return self.num
+
+    def random_points(self, num):
+        margin = 2 * self.radius
+        return np.column_stack((self.rng.uniform(margin, self.width - margin, num),
+                                self.rng.uniform(margin, self.height - margin, num)))
+
+    def neighbor_pairs(self):
+        """
+        Indices (i, j), i < j, of the pedestrian pairs in neighbouring
+        cells of a grid of cutoff sized cells.
+        """
+        n = self.num
+        nx = int(math.ceil(self.width / self.cutoff)) + 1
+        ny = int(math.ceil(self.height / self.cutoff)) + 1
+        cx = np.clip((self.positions[:, 0] // self.cutoff).astype(int), 0, nx - 1)
+        cy = np.clip((self.positions[:, 1] // self.cutoff).astype(int), 0, ny - 1)
+        cells = cx * ny + cy
+        order = np.argsort(cells, kind='stable')
+        starts = np.searchsorted(cells[order], np.arange(nx * ny + 1))
+
+        # Half of the 8 neighbour cells plus the cell itself, so every
+        # pair of cells is visited once
+        first, second = [], []
+        for dx, dy in [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]:
+            ox, oy = cx + dx, cy + dy
+            valid = (ox < nx) & (oy >= 0) & (oy < ny)
+            other = np.where(valid, ox * ny + oy, 0)
+            begin = starts[other]
+            counts = np.where(valid, starts[other + 1] - begin, 0)
+            total = counts.sum()
+            if total == 0:
+                continue
+            i = np.repeat(np.arange(n), counts)
+            # Position of each pair inside the run of its cell
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            j = order[np.repeat(begin, counts) + offsets]
+            if dx == 0 and dy == 0:
+                keep = i < j
+                i, j = i[keep], j[keep]
+            first.append(i)
+            second.append(j)
+        if not first:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        return np.concatenate(first), np.concatenate(second)
+
+    def repulsion(self, dx, dy, reach, strength, decay):
+        """
+        Exponential repulsion along (dx, dy) = this - other position, with
+        reach the sum of the radii. Pairs beyond the cutoff get no force.
+        The x and y components are separate 1d arrays, which index and
+        broadcast faster than (N, 2) rows.
+        """
+        dist = np.sqrt(dx * dx + dy * dy)
+        gap = dist - reach
+        magnitude = strength * np.exp(-gap / decay)
+        magnitude[gap > cutoff_ranges * decay] = 0.
+        magnitude /= np.maximum(dist, 1e-9)
+        return dx * magnitude, dy * magnitude
+
+    def step(self, dt, robot_position=None, robot_radius=0.):
+        n = self.num
+        pos = self.positions
+
+        # New goals for the pedestrians which arrived
+        to_goal = self.goals - pos
+        goal_dist = np.sqrt(np.einsum('ij,ij->i', to_goal, to_goal))
+        arrived = goal_dist < 2 * self.radius
+        if arrived.any():
+            self.goals[arrived] = self.random_points(arrived.sum())
+            to_goal[arrived] = self.goals[arrived] - pos[arrived]
+            goal_dist[arrived] = np.sqrt(np.einsum('ij,ij->i', to_goal[arrived], to_goal[arrived]))
+
+        # Driving force towards the preferred velocity
+        desired = to_goal * (self.speeds / np.maximum(goal_dist, 1e-9))[:, None]
+        force = (desired - self.velocities) / relaxation_time
+
+        # Pedestrian pairs push each other apart
+        x, y = pos[:, 0].copy(), pos[:, 1].copy()
+        i, j = self.neighbor_pairs()
+        dx, dy = x.take(i) - x.take(j), y.take(i) - y.take(j)
+        near = dx * dx + dy * dy < self.cutoff ** 2
+        i, j, dx, dy = i[near], j[near], dx[near], dy[near]
+        if len(i):
+            fx, fy = self.repulsion(dx, dy, 2 * self.radius, ped_strength, ped_range)
+            both = np.concatenate((i, j))
+            force[:, 0] += np.bincount(both, np.concatenate((fx, -fx)), n)
+            force[:, 1] += np.bincount(both, np.concatenate((fy, -fy)), n)
+
+        # Walls on the 4 edges, only the nearest point of each matters
+        for axis, size in [(0, self.width), (1, self.height)]:
+            for edge, sign in [(0., 1.), (size, -1.)]:
+                gap = sign * (pos[:, axis] - edge) - self.radius
+                force[:, axis] += sign * wall_strength * np.exp(-np.maximum(gap, 0.) / wall_range) * \
+                    (gap < cutoff_ranges * wall_range)
+
+        # Static obstacles and the robot
+        if len(self.obstacles):
+            fx, fy = self.repulsion(x[:, None] - self.obstacles[:, 0], y[:, None] - self.obstacles[:, 1],
+                                    self.radius + self.obstacle_radius, wall_strength, wall_range)
+            force[:, 0] += fx.sum(axis=1)
+            force[:, 1] += fy.sum(axis=1)
+        if robot_position is not None:
+            fx, fy = self.repulsion(x - robot_position[0], y - robot_position[1],
+                                    self.radius + robot_radius, wall_strength, wall_range)
+            force[:, 0] += fx
+            force[:, 1] += fy
+
+        # Semi-implicit Euler with a speed limit
+        self.velocities += force * dt
+        speed = np.sqrt(np.einsum('ij,ij->i', self.velocities, self.velocities))
+        too_fast = speed > self.max_speeds
+        self.velocities[too_fast] *= (self.max_speeds[too_fast] / speed[too_fast])[:, None]
+        self.positions += self.velocities * dt
+        np.clip(self.positions[:, 0], self.radius, self.width - self.radius, out=self.positions[:, 0])
+        np.clip(self.positions[:, 1], self.radius, self.height - self.radius, out=self.positions[:, 1])
+
+    def nearest(self, position, velocity, radius):
+        """
+        Gap between a circle and the nearest pedestrian, and how fast that
+        pedestrian is closing in (positive when approaching).
+        """
+        if self.num == 0:
+            return np.inf, 0.
+        delta = self.positions - position
+        dist = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+        k = np.argmin(dist)
+        closing = -np.dot(self.velocities[k] - velocity, delta[k]) / max(dist[k], 1e-9)
+        return dist[k] - radius - self.radius, closing
+
+    def draw(self, surface):
+        """Draw the pedestrians and their heading, y pointing up"""
+        import pygame
+        from pygame.color import THECOLORS
+
+        height = surface.get_height()
+        r = int(round(self.radius))
+        heads = self.positions + self.velocities * (self.radius / np.maximum(
+            self.max_speeds, 1e-9))[:, None]
+        for (x, y), (hx, hy) in zip(self.positions.tolist(), heads.tolist()):
+            p = int(round(x)), int(round(height - y))
+            pygame.draw.circle(surface, THECOLORS['green'], p, r, 0)
+            pygame.draw.line(surface, THECOLORS['black'], p, (int(round(hx)), int(round(height - hy))), 1)
+
+
+def time_crowd(num, frames=200, fps=60, width=1200, height=900):
+    """Seconds per step of a crowd of num pedestrians"""
+    import time
+
+    crowd = Crowd(num, width, height, rng=np.random.RandomState(0))
+    robot = np.array([100., 100.])
+    start = time.time()
+    for t in range(frames):
+        crowd.step(1. / fps, robot, 30)
+    return (time.time() - start) / frames
+
+
+if __name__ == "__main__":
+    for num in [100, 1000, 2000, 5000]:
+        seconds = time_crowd(num)
+        print("%5d pedestrians: %.2fms per step, %.0f steps/s" % (num, seconds * 1e3, 1. / seconds))
@@ -0,0 +1,278 @@
+"""
+Evaluate saved checkpoints headless, in parallel.
+
+Every checkpoint matching the patterns plays the same seeded scenarios,
+greedily with NumPy inference, in a pool of worker processes. A scenario
+keeps the obstacles of training, which the (x, y, angle) state of the
+models can't see, and starts the robot at a position and heading drawn
+from its seed. An episode ends at the goal, after max_frames frames or
+after timeout seconds. The results are summed up per checkpoint:
+
+    python evaluation.py 'saved-models/*.h5' [--scenarios 10] [--max-frames 4000]
+        [--obstacles N] [--fixed-start] [--pedestrians N] [--lidar-beams N]
+        [--physics numpy] [--spatial-index] [--workers N] [--csv results/eval.csv]
+
+The policies are deterministic, so scenarios starting the same way play
+the same episode; they are only played once. With the start of training
+and no pedestrians, only the start heading is random and there are 2.
+Checkpoints taking states of another size than the scenarios give are
+reported as skipped.
+"""
+
+import os
+import csv
+import glob
+import math
+import time
+import random
+import numpy as np
+
+from util import pool_imap
+
+# Seeded episodes each checkpoint plays, and their random obstacles, None
+# for the fixed obstacles of training
+SCENARIOS = 10
+OBSTACLES = None
+# Random starts are at least this far from the goal
+START_GOAL_DISTANCE = 300
+# Frames before an episode counts as a failure, and wall clock seconds
+MAX_FRAMES = 4000
+TIMEOUT = 60.
+FPS = 60
+
+# Per worker process: loaded models and idle games
+models = {}
+games = None
+
+
+def make_scenarios(num, seed=0, num_obstacles=OBSTACLES, num_pedestrians=0, physics='pymunk',
+                   spatial_index=False, lidar_beams=0, random_start=True):
+    """
+    num scenarios, each a game seed with the game settings.
+    num_obstacles None is the fixed layout of the 10 obstacles. Without
+    random_start the robot starts where it does in training.
+    """
+    return [{'seed': seed + i, 'num_obstacles': num_obstacles, 'num_pedestrians': num_pedestrians,
+             'physics': physics, 'spatial_index': spatial_index, 'lidar_beams': lidar_beams,
+             'random_start': random_start}
+            for i in range(num)]
+
+
+def scenario_game(games, scenario):
+    """A headless game of the pool, at the start of the scenario"""
+    game = games.acquire(scenario['seed'], draw_screen = False, display_path = False, fps = FPS,
+                         physics = scenario['physics'], num_obstacles = scenario['num_obstacles'],
+                         num_pedestrians = scenario['num_pedestrians'],
+                         spatial_index = scenario['spatial_index'],
+                         lidar_beams = scenario['lidar_beams'])
+    if scenario['random_start']:
+        start_pose(game, scenario['seed'])
+    return game
+
+
+def start_pose(game, seed):
+    """
+    Move the robot to a position and heading drawn from seed, clear of
+    the walls, obstacles and pedestrians, and away from the goal
+    """
+    from GameClass import width, height, robot_radius, obs_radius, ped_radius
+
+    rng = random.Random(seed)
+    margin = 2 * robot_radius
+    while True:
+        position = np.array([rng.uniform(margin, width - margin),
+                             rng.uniform(margin, height - margin)])
+        clear = np.linalg.norm(game.obstacle_positions - position, axis=1).min() > \
+            obs_radius + margin
+        if game.crowd is not None:
+            clear = clear and np.linalg.norm(game.crowd.positions - position, axis=1).min() > \
+                ped_radius + margin
+        if clear and np.linalg.norm(position - game.goal_position) > START_GOAL_DISTANCE:
+            break
+    angle = rng.uniform(-math.pi, math.pi)
+    game.robot_body.position = tuple(position.tolist())
+    # The speed is set by the physics, like the (+-1, 10) of add_robot
+    game.robot_body.velocity = (10 * math.cos(angle), 10 * math.sin(angle))
+
+
+def start_key(game):
+    # Everything a greedy episode depends on
+    parts = [game.obstacle_positions, np.array(game.goal_position, dtype=float),
+             np.array(tuple(game.robot_body.position), dtype=float),
+             np.array(tuple(game.robot_body.velocity), dtype=float)]
+    if game.crowd is not None:
+        parts.append(game.crowd.positions)
+    return b''.join(np.ascontiguousarray(p).tobytes() for p in parts)
+
+
+def distinct_scenarios(scenarios):
+    """The scenarios whose games start differently, the first of each"""
+    from GameClass import GamePool
+
+    pool = GamePool()
+    seen = set()
+    distinct = []
+    for scenario in scenarios:
+        game = scenario_game(pool, scenario)
+        key = start_key(game)
+        pool.release(game)
+        if key not in seen:
+            seen.add(key)
+            distinct.append(scenario)
+    return distinct
+
+
+def play_episode(job):
+    """
+    Play one scenario with one checkpoint. Return the checkpoint and a
+    dict: reached the goal, frames played, frames with a collision, timed
+    out. Or the reason it was skipped, when the checkpoint can't play the
+    scenario.
+    """
+    global games
+    from GameClass import GamePool
+    from inference import load_model
+    from qvalues import predict_q, state_size
+
+    path, scenario, max_frames, timeout = job
+    if path not in models:
+        models[path] = load_model(path)
+    model = models[path]
+    if games is None:
+        games = GamePool()
+
+    game = scenario_game(games, scenario)
+    if game.state_dim != state_size(model):
+        games.release(game)
+        return path, {'skipped': "takes states of %d values, the scenarios give %d" %
+                                 (state_size(model), game.state_dim)}
+    try:
+        # Choose no action in the initial frame
+        _, state = game.frame_step(2)
+        start = time.time()
+        frames = collisions = 0
+        reached = timed_out = False
+        while frames < max_frames:
+            action = np.argmax(predict_q(model, state)[0])
+            reward, state = game.frame_step(action)
+            frames += 1
+            if game.hit_obstacle or game.hit_wall or game.pedestrian_gap < 0:
+                collisions += 1
+            if game.check_reach_goal():
+                reached = True
+                break
+            if frames % 100 == 0 and time.time() - start > timeout:
+                timed_out = True
+                break
+    finally:
+        games.release(game)
+    return path, {'reached': reached, 'frames': frames, 'collisions': collisions,
+                  'timed_out': timed_out}
+
+
+def summarize(episodes):
+    """Success rate, collision rate and mean path length of a checkpoint's episodes"""
+    reached = [e for e in episodes if e['reached']]
+    return {
+        'episodes': len(episodes),
+        'success_rate': len(reached) / len(episodes),
+        # Episodes with at least one collision
+        'collision_rate': np.mean([e['collisions'] > 0 for e in episodes]),
+        'collisions': np.mean([e['collisions'] for e in episodes]),
+        'mean_path': np.mean([e['frames'] for e in reached]) if reached else float('nan'),
+        'timeouts': sum(e['timed_out'] for e in episodes),
+    }
+
+
+def evaluate(paths, scenarios, max_frames=MAX_FRAMES, timeout=TIMEOUT, workers=None):
+    """
+    Play every scenario with every checkpoint, return {path: summary}, or
+    {path: {'skipped': reason}} for the checkpoints which can't play them
+    """
+    jobs = [(path, scenario, max_frames, timeout) for path in paths for scenario in scenarios]
+    results = {path: [] for path in paths}
+    skipped = {}
+    if not jobs:
+        return {}
+    # Jobs of a checkpoint are adjacent, so a worker mostly reuses the
+    # model it loaded
+    for path, episode in pool_imap(play_episode, jobs, workers, max(1, len(scenarios) // 2),
+                                   ordered=False):
+        if 'skipped' in episode:
+            skipped[path] = episode
+        else:
+            results[path].append(episode)
+    return {path: skipped.get(path) or summarize(episodes) for path, episodes in results.items()}
+
+
+def checkpoint_order(path):
+    # By network size, then checkpoint index. Numbers and words like
+    # 'multi' are compared apart, numbers first.
+    name = os.path.splitext(os.path.basename(path))[0]
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in name.split('-')]
+
+
+COLUMNS = ['episodes', 'success_rate', 'collision_rate', 'collisions', 'mean_path', 'timeouts']
+
+
+def add_arguments(parser):
+    parser.add_argument('patterns', nargs='+', help='checkpoint paths or glob patterns')
+    parser.add_argument('--scenarios', type=int, default=SCENARIOS)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first scenario')
+    parser.add_argument('--obstacles', type=int, default=OBSTACLES,
+                        help='obstacles placed at random from the seed of each scenario, '
+                             'instead of the 10 of training')
+    parser.add_argument('--fixed-start', action='store_true',
+                        help='start the robot where it does in training; without pedestrians '
+                             'this leaves only 2 distinct scenarios')
+    parser.add_argument('--pedestrians', type=int, default=0)
+    parser.add_argument('--lidar-beams', type=int, default=0,
+                        help='lidar beams of the state, for checkpoints trained with them')
+    parser.add_argument('--physics', default='pymunk', choices=['pymunk', 'numpy'])
+    parser.add_argument('--spatial-index', action='store_true',
+                        help='grid index of the obstacles, faster with hundreds of them')
+    parser.add_argument('--max-frames', type=int, default=MAX_FRAMES)
+    parser.add_argument('--timeout', type=float, default=TIMEOUT, help='seconds per episode')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--csv', default=None, help='also write the table to this file')
+
+
+def main(args):
+    paths = sorted({p for pattern in args.patterns for p in glob.glob(pattern)}, key=checkpoint_order)
+    scenarios = make_scenarios(args.scenarios, args.seed, args.obstacles, args.pedestrians,
+                               args.physics, args.spatial_index, args.lidar_beams,
+                               not args.fixed_start)
+    distinct = distinct_scenarios(scenarios)
+    if len(distinct) < len(scenarios):
+        print("%d of the %d scenarios are distinct, playing those" % (len(distinct), len(scenarios)))
+    scenarios = distinct
+    start = time.time()
+    summaries = evaluate(paths, scenarios, args.max_frames, args.timeout, args.workers)
+
+    print("%-44s %8s %8s %9s %10s %9s %8s" %
+          ('checkpoint', 'episodes', 'success', 'collided', 'collisions', 'mean path', 'timeouts'))
+    for path in paths:
+        s = summaries[path]
+        if 'skipped' in s:
+            print("%-44s skipped, %s" % (os.path.basename(path), s['skipped']))
+            continue
+        print("%-44s %8d %7.0f%% %8.0f%% %10.1f %9.0f %8d" %
+              (os.path.basename(path), s['episodes'], 100 * s['success_rate'],
+               100 * s['collision_rate'], s['collisions'], s['mean_path'], s['timeouts']))
+    print("%d checkpoints x %d scenarios in %.1fs" % (len(paths), len(scenarios), time.time() - start))
+
+    if args.csv:
+        with open(args.csv, 'w') as f:
+            wr = csv.writer(f)
+            wr.writerow(['checkpoint'] + COLUMNS)
+            for path in paths:
+                if 'skipped' not in summaries[path]:
+                    wr.writerow([path] + [summaries[path][c] for c in COLUMNS])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Evaluate checkpoints on seeded scenarios")
+    add_arguments(parser)
+    main(parser.parse_args())
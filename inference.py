@@ -0,0 +1,141 @@
+"""
+Run the saved Keras models with NumPy only.
+
+The networks built by nn.neural_net are small MLPs, so a Keras predict on
+one row is mostly call overhead. load_model reads the Dense weights out of
+a saved-models/*.h5 checkpoint with h5py, or out of a weights-only .npz
+checkpoint (see checkpoint.py), and NumpyModel runs the forward pass with
+Dropout disabled, without importing TensorFlow.
+"""
+
+import json
+import numpy as np
+
+from checkpoint import load_weights
+
+
+def relu(x):
+    return np.maximum(x, 0, out=x)
+
+def linear(x):
+    return x
+
+def tanh(x):
+    return np.tanh(x, out=x)
+
+def sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+activations = {'relu': relu, 'linear': linear, 'tanh': tanh, 'sigmoid': sigmoid}
+
+
+class NumpyModel:
+    def __init__(self, kernels, biases, activation_names):
+        """One (kernel, bias, activation name) per Dense layer"""
+        self.activation_names = list(activation_names)
+        self.set_weights([w for pair in zip(kernels, biases) for w in pair])
+
+    def set_weights(self, weights):
+        """Load weights ordered as model.get_weights() of the Keras model"""
+        self.kernels = [np.asarray(w, dtype=np.float32) for w in weights[0::2]]
+        self.biases = [np.asarray(b, dtype=np.float32) for b in weights[1::2]]
+        self.activations = [activations[a] for a in self.activation_names]
+        self.input_shape = (None, self.kernels[0].shape[0])
+        self.output_shape = (None, self.kernels[-1].shape[1])
+
+    def get_weights(self):
+        return [w for pair in zip(self.kernels, self.biases) for w in pair]
+
+    def predict(self, x, batch_size=None):
+        """Same signature as Keras predict, the whole batch goes at once"""
+        x = np.asarray(x, dtype=np.float32).reshape((-1, self.input_shape[1]))
+        for kernel, bias, activation in zip(self.kernels, self.biases, self.activations):
+            x = activation(x.dot(kernel) + bias)
+        return x
+
+    @classmethod
+    def from_keras(cls, model):
+        """Copy a live Keras model, e.g. to choose actions while training"""
+        return cls(*dense_layers(model.get_config(), model.get_weights()))
+
+
+def dense_layers(config, weights):
+    """
+    Split a Sequential config and its weights into the kernels, biases and
+    activations of the Dense layers. An Activation layer is merged into
+    the linear Dense layer before it, Dropout does nothing at inference.
+    """
+    # Keras 2.1 stores the layer list, later versions a dict with 'layers'
+    layers = config['layers'] if isinstance(config, dict) else config
+    kernels, biases, names = [], [], []
+    weights = list(weights)
+    for layer in layers:
+        kind = layer['class_name']
+        if kind == 'Dense':
+            kernels.append(weights.pop(0))
+            biases.append(weights.pop(0) if layer['config']['use_bias'] else
+                          np.zeros(layer['config']['units'], dtype=np.float32))
+            names.append(layer['config']['activation'])
+        elif kind == 'Activation':
+            if names[-1] != 'linear':
+                raise ValueError("Can't merge activation %s after %s" %
+                                 (layer['config']['activation'], names[-1]))
+            names[-1] = layer['config']['activation']
+        elif kind not in ['Dropout', 'InputLayer']:
+            raise ValueError("Layer %s is not supported" % kind)
+    return kernels, biases, names
+
+
+def load_model(path):
+    """Load a model saved with model.save() or a CheckpointWriter as a NumpyModel"""
+    if path.endswith('.npz'):
+        config, weights = load_weights(path)
+    else:
+        config, weights = read_h5(path)
+    return NumpyModel(*dense_layers(config, weights))
+
+
+def read_h5(path):
+    """The model config and the weights of a Keras .h5 file"""
+    # Only .h5 checkpoints need h5py
+    import h5py
+    with h5py.File(path, 'r') as f:
+        config = json.loads(f.attrs['model_config'])['config']
+        group = f['model_weights'] if 'model_weights' in f else f
+        weights = []
+        for name in group.attrs['layer_names']:
+            layer = group[name.decode() if isinstance(name, bytes) else name]
+            for weight_name in layer.attrs['weight_names']:
+                if isinstance(weight_name, bytes):
+                    weight_name = weight_name.decode()
+                weights.append(layer[weight_name][()])
+    return config, weights
+
+
+def compare_with_keras(path, num_rows=1000):
+    """Largest difference between the Keras and NumPy outputs of a checkpoint"""
+    from keras.models import load_model as keras_load_model
+
+    keras_model = keras_load_model(path)
+    numpy_model = load_model(path)
+    x = np.random.uniform(0, 1200, (num_rows, numpy_model.input_shape[1]))
+    return np.max(np.abs(keras_model.predict(x) - numpy_model.predict(x)))
+
+
+if __name__ == "__main__":
+    import glob
+    import time
+
+    for path in sorted(glob.glob('saved-models/model_nn-*.h5') + glob.glob('saved-models/model_nn-*.npz')):
+        start = time.time()
+        model = load_model(path)
+        load_time = time.time() - start
+
+        row = np.array([[100., 100., 1.4, 0., 0., 1.]])[:, :model.input_shape[1]]
+        runs = 1000
+        start = time.time()
+        for i in range(runs):
+            model.predict(row)
+        predict_time = (time.time() - start) / runs
+        print("%s: load %.1fms, predict one row %.1fus" %
+              (path, load_time * 1e3, predict_time * 1e6))
@@ -0,0 +1,99 @@
+"""
+Append-only binary training metrics.
+
+A metrics file is a short header describing the record dtype, followed by
+fixed-width records. The writer fills a preallocated buffer and appends
+it to the file every flush_every records or flush_seconds, so a crash
+loses at most that much and memory stays constant however long the run.
+read_metrics memory maps the complete records, so plotting and other
+tools can read a file while training is still writing it.
+"""
+
+import json
+import time
+import struct
+import numpy as np
+
+MAGIC = b'RNMETRIC'
+
+# One record per frame of trainning.train
+RECORD = np.dtype([
+    ('frame', '<i8'),        # total frames played
+    ('episode', '<i4'),
+    ('reward', '<f4'),
+    ('epsilon', '<f4'),
+    ('loss', '<f4'),         # nan if the frame didn't train
+    ('path_length', '<i4'),  # frames of the episode if it reached the goal, else 0
+    ('step_time', '<f4'),    # seconds in frame_step
+    ('train_time', '<f4'),   # seconds training the model
+])
+
+
+def default_record(dtype):
+    # nan for the float fields, 0 for the others
+    return tuple(np.nan if dtype[name].kind == 'f' else 0 for name in dtype.names)
+
+
+class MetricsWriter:
+    def __init__(self, path, dtype=RECORD, flush_every=1000, flush_seconds=5.):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.defaults = default_record(self.dtype)
+        self.buffer = np.zeros(flush_every, dtype=self.dtype)
+        self.count = 0
+        self.flush_seconds = flush_seconds
+        self.last_flush = time.monotonic()
+
+        # Header: magic, length of the dtype description, the description
+        # as JSON padded so the records start on an 8 byte boundary
+        descr = json.dumps(self.dtype.descr).encode()
+        descr += b' ' * (-(len(MAGIC) + 4 + len(descr)) % 8)
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + struct.pack('<I', len(descr)) + descr)
+        self.file.flush()
+
+    def write(self, **fields):
+        """Append one record, the fields not given are nan or 0"""
+        self.buffer[self.count] = tuple(fields.get(name, default)
+                                        for name, default in zip(self.dtype.names, self.defaults))
+        self.count += 1
+        if self.count == len(self.buffer) or time.monotonic() - self.last_flush > self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer[:self.count].tobytes())
+        self.file.flush()
+        self.count = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_metrics(path):
+    """
+    Memory map the complete records of a metrics file, which may still be
+    written. Call again to see the records appended since.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(len(MAGIC) + 4)
+        if head[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a metrics file" % path)
+        length, = struct.unpack('<I', head[len(MAGIC):])
+        descr = json.loads(f.read(length).decode())
+        size = f.seek(0, 2)
+    # JSON turns the (name, type) tuples into lists
+    dtype = np.dtype([tuple(field) for field in descr])
+    offset = len(MAGIC) + 4 + length
+    num = (size - offset) // dtype.itemsize
+    if num == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(num,))
@@ -18,7 +18,9 @@ class LossHistory(Callback):
         self.losses.append(logs.get('loss'))
 
 
-def neural_net(num_inputs, params):
+def neural_net(num_inputs, params, num_outputs=1):
+    # num_outputs=1 gives Q(s,a) for [state, encoded action] inputs,
+    # num_outputs=3 gives the multi-head [Q(s,0), Q(s,1), Q(s,2)] from the state
     model = Sequential()
 
     # First layer.
@@ -37,7 +39,7 @@ def neural_net(num_inputs, params):
     model.add(Dropout(0.2))
 
     # Output layer.
-    model.add(Dense(1, kernel_initializer='lecun_uniform',
+    model.add(Dense(num_outputs, kernel_initializer='lecun_uniform',
         use_bias = True, bias_initializer = 'zeros'
     ))
     model.add(Activation('linear'))
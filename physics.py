@@ -0,0 +1,308 @@
+"""
+Pure NumPy replacement for the part of pymunk used by GameClass: one
+constant speed circle robot bouncing off static circles and border
+segments. The step follows the order of a chipmunk step (integrate
+positions, find contacts, integrate velocities, solve impulses) so the
+trajectories stay close to the pymunk ones.
+"""
+
+import math
+import numpy as np
+
+from spatial import SpatialHash, INDEX_MIN
+
+# What a static shape is, for the contact flags
+OBSTACLE = 0
+WALL = 1
+GOAL = 2
+
+# pymunk.Space defaults
+collision_slop = 0.1
+collision_bias = pow(1 - 0.1, 60)
+iterations = 10
+
+
+class NumpyBody:
+    """Robot body with the pymunk.Body attributes used by GameClass"""
+    def __init__(self, x, y):
+        self.position = (float(x), float(y))
+        self.velocity = (0., 0.)
+        self.angle = 0.
+
+
+class NumpySpace:
+    def __init__(self, cell_size=None):
+        """With a cell_size, shapes are kept in a SpatialHash and, once
+        there are INDEX_MIN of them, only the ones near the robot are
+        tested"""
+        self.index = SpatialHash(cell_size) if cell_size else None
+        self.robot_body = None
+        self.robot_radius = 0.
+        self.robot_speed = 0.
+        self.v_bias = (0., 0.)
+
+        # Every static shape is stored as a rounded segment (a, b, radius):
+        # a circle is a segment with a == b. kind tells what the robot hit.
+        self.seg_a = np.zeros((0, 2))
+        self.seg_ab = np.zeros((0, 2))
+        self.inv_len2 = np.zeros(0)
+        self.radii = np.zeros(0)
+        self.elasticity = np.zeros(0)
+        self.kind = np.zeros(0, dtype=int)
+
+        # Where the shapes were last tested and how far the robot can move
+        # from there before it may touch one. Static shapes are never
+        # nearer than that, so most steps skip the test completely.
+        self.check_position = (0., 0.)
+        self.clearance = -1.
+
+        # Contacts found in the last step
+        self.hit_obstacle = False
+        self.hit_wall = False
+        self.reach_goal = False
+
+    def add_robot(self, x, y, radius, speed):
+        self.robot_body = NumpyBody(x, y)
+        self.robot_radius = radius
+        self.robot_speed = speed
+        self.update_reach()
+        return self.robot_body
+
+    def add_shape(self, a, b, radius, elasticity, kind):
+        ab = np.subtract(b, a, dtype=float)
+        len2 = ab.dot(ab)
+        self.seg_a = np.vstack((self.seg_a, a))
+        self.seg_ab = np.vstack((self.seg_ab, ab))
+        self.inv_len2 = np.append(self.inv_len2, 1. / len2 if len2 > 0 else 0.)
+        self.radii = np.append(self.radii, radius)
+        self.elasticity = np.append(self.elasticity, elasticity)
+        self.kind = np.append(self.kind, kind)
+        self.update_reach()
+        self.clearance = -1.
+        if self.index is not None:
+            self.index.insert_segment(len(self.radii) - 1, a, b, radius)
+        return len(self.radii) - 1
+
+    def reset(self):
+        """Forget the solver and contact state of the last episode"""
+        self.v_bias = (0., 0.)
+        self.check_position = (0., 0.)
+        self.clearance = -1.
+        self.hit_obstacle = False
+        self.hit_wall = False
+        self.reach_goal = False
+
+    def move_circle(self, shape, x, y):
+        """Move a circle shape, as returned by add_obstacle or add_goal"""
+        self.seg_a[shape] = x, y
+        self.clearance = -1.
+        if self.index is not None:
+            r = self.radii[shape]
+            self.index.move(shape, x - r, y - r, x + r, y + r)
+
+    def update_reach(self):
+        # Squared contact distance of every shape
+        self.reach = self.radii + self.robot_radius
+        self.reach2 = self.reach ** 2
+
+    def add_obstacle(self, x, y, radius):
+        return self.add_shape((x, y), (x, y), radius, 1., OBSTACLE)
+
+    def add_goal(self, x, y, radius):
+        return self.add_shape((x, y), (x, y), radius, 0., GOAL)
+
+    def add_segment(self, a, b, radius):
+        return self.add_shape(a, b, radius, 1., WALL)
+
+    def find_contacts(self, x, y):
+        """
+        Closed form circle-segment test of the robot against every static
+        shape in one pass. Return the indices of the touched shapes with
+        the contact normals (pointing away from the robot) and depths.
+        """
+        self.check_position = (x, y)
+        seg_a, seg_ab, inv_len2, reach = self.seg_a, self.seg_ab, self.inv_len2, self.reach
+        indexed = self.index is not None and len(self.index) >= INDEX_MIN
+        if indexed:
+            # Shapes outside the queried box are at least `far` away
+            far = self.robot_radius + self.index.cell_size
+            near = self.index.query_circle(x, y, far)
+            seg_a, seg_ab = seg_a[near], seg_ab[near]
+            inv_len2, reach = inv_len2[near], reach[near]
+        else:
+            far = np.inf
+
+        ap = np.array((x, y)) - seg_a
+        t = np.einsum('ij,ij->i', ap, seg_ab) * inv_len2
+        np.maximum(t, 0., out=t)
+        np.minimum(t, 1., out=t)
+        delta = seg_a + t[:, None] * seg_ab
+        delta -= (x, y)
+        dist = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+        gaps = dist - reach
+        # Margin for rounding errors
+        self.clearance = min(gaps.min(initial=np.inf), far - self.robot_radius) - 1e-9
+        if self.clearance > 0:
+            return None, None, None
+        hit = np.nonzero(gaps < 0)[0]
+        normals = delta[hit] / np.maximum(dist[hit], 1e-12)[:, None]
+        if indexed:
+            return near[hit], normals, -gaps[hit]
+        return hit, normals, -gaps[hit]
+
+    def step(self, dt):
+        body = self.robot_body
+        vx, vy = body.velocity
+        bx, by = self.v_bias
+
+        # Integrate the position, including last step's penetration fix
+        x, y = body.position
+        x += (vx + bx) * dt
+        y += (vy + by) * dt
+        body.position = (x, y)
+        bx = by = 0.
+        self.v_bias = (0., 0.)
+
+        hit = None
+        cx, cy = self.check_position
+        if math.sqrt((x - cx)**2 + (y - cy)**2) >= self.clearance:
+            hit, normals, depths = self.find_contacts(x, y)
+        if hit is None or len(hit) == 0:
+            hit = ()
+            self.hit_obstacle = self.hit_wall = self.reach_goal = False
+        else:
+            kinds = self.kind[hit]
+            self.hit_obstacle = OBSTACLE in kinds
+            self.hit_wall = WALL in kinds
+            self.reach_goal = GOAL in kinds
+
+        # Bounce targets use the velocity from before the velocity update
+        if len(hit):
+            bounce = self.elasticity[hit] * normals.dot((vx, vy))
+            bias = (1. - pow(collision_bias, dt)) * np.maximum(depths - collision_slop, 0.) / dt
+
+        # Keep the robot velocity at a constant speed
+        speed = math.sqrt(vx**2 + vy**2)
+        if speed != 0:
+            vx = vx / speed * self.robot_speed
+            vy = vy / speed * self.robot_speed
+
+        if len(hit) == 0:
+            body.velocity = (vx, vy)
+            return
+
+        # Sequential impulses with accumulated clamping, as in chipmunk.
+        # The other bodies are static so only the robot velocity changes.
+        jn_acc = [0.] * len(hit)
+        jb_acc = [0.] * len(hit)
+        for _ in range(iterations):
+            for i, (nx, ny) in enumerate(normals.tolist()):
+                jn_old = jn_acc[i]
+                jn_acc[i] = max(jn_old + nx*vx + ny*vy + bounce[i], 0.)
+                vx -= nx * (jn_acc[i] - jn_old)
+                vy -= ny * (jn_acc[i] - jn_old)
+
+                jb_old = jb_acc[i]
+                jb_acc[i] = max(jb_old + nx*bx + ny*by + bias[i], 0.)
+                bx -= nx * (jb_acc[i] - jb_old)
+                by -= ny * (jb_acc[i] - jb_old)
+        body.velocity = (vx, vy)
+        self.v_bias = (bx, by)
+
+    def debug_draw(self, surface):
+        """Draw the shapes like pymunk.pygame_util does, y pointing up"""
+        import pygame
+        from pygame.color import THECOLORS
+
+        height = surface.get_height()
+
+        def to_pygame(p):
+            return int(round(p[0])), int(round(height - p[1]))
+
+        colors = {OBSTACLE: THECOLORS['blue'], WALL: THECOLORS['brown'], GOAL: THECOLORS['red']}
+        for a, ab, r, kind in zip(self.seg_a, self.seg_ab, self.radii, self.kind):
+            if kind == WALL:
+                pygame.draw.line(surface, colors[kind], to_pygame(a), to_pygame(a + ab),
+                                 int(round(max(1, r * 2))))
+            else:
+                pygame.draw.circle(surface, colors[kind], to_pygame(a), int(round(r)), 0)
+        body = self.robot_body
+        p = to_pygame(body.position)
+        pygame.draw.circle(surface, THECOLORS['orange'], p, int(round(self.robot_radius)), 0)
+        edge = (body.position[0] + self.robot_radius * math.cos(body.angle),
+                body.position[1] + self.robot_radius * math.sin(body.angle))
+        pygame.draw.lines(surface, THECOLORS['black'], False, [p, to_pygame(edge)], 2)
+
+
+def compare_backends(frames=2000, seed=0, fps=60):
+    """
+    Run the same random episode with both backends.
+
+    The robot of the numpy game is synced to the pymunk one after every
+    frame, so the returned gap (in pixels) is the largest one step error;
+    free running trajectories drift apart from rounding errors amplified by
+    grazing contacts. Also return the wall time of a free run of each.
+    """
+    import random
+    import time
+    from GameClass import GameClass
+
+    random.seed(seed)
+    actions = np.random.RandomState(seed).randint(0, 3, frames)
+
+    times = {}
+    for physics in ['pymunk', 'numpy']:
+        random.seed(seed)
+        game = GameClass(draw_screen = False, display_path = False, fps = fps, physics = physics)
+        start = time.time()
+        for action in actions:
+            game.frame_step(action)
+            if game.exit:
+                break
+        times[physics] = time.time() - start
+
+    random.seed(seed)
+    pymunk_game = GameClass(draw_screen = False, display_path = False, fps = fps)
+    random.seed(seed)
+    numpy_game = GameClass(draw_screen = False, display_path = False, fps = fps, physics = 'numpy')
+    gap = 0.
+    for action in actions:
+        pymunk_reward, pymunk_state = pymunk_game.frame_step(action)
+        numpy_reward, numpy_state = numpy_game.frame_step(action)
+        assert pymunk_reward == numpy_reward, "contacts differ between backends"
+        gap = max(gap, np.linalg.norm(pymunk_state[:2] - numpy_state[:2]))
+        if pymunk_game.exit:
+            break
+        numpy_game.robot_body.position = tuple(pymunk_game.robot_body.position)
+        numpy_game.robot_body.velocity = tuple(pymunk_game.robot_body.velocity)
+    return gap, times
+
+
+def time_physics(physics, frames=3000, fps=60):
+    """Seconds per physics step plus the three contact checks"""
+    import time
+    from GameClass import GameClass
+
+    game = GameClass(draw_screen = False, display_path = False, fps = fps, physics = physics)
+    start = time.time()
+    for t in range(frames):
+        game.update(fps)
+        game.check_hit_obstacle()
+        game.check_hit_wall()
+        game.check_reach_goal()
+    return (time.time() - start) / frames
+
+
+if __name__ == "__main__":
+    # One step error allowed between the backends, in pixels
+    tolerance = 1e-6
+    for seed in range(5):
+        gap, times = compare_backends(seed=seed)
+        print("seed %d: max gap %.2e px, frame_step pymunk %.3fs, numpy %.3fs, speedup %.1fx" %
+              (seed, gap, times['pymunk'], times['numpy'], times['pymunk'] / times['numpy']))
+        assert gap < tolerance, "numpy backend diverged from pymunk"
+
+    pymunk_time = time_physics('pymunk')
+    numpy_time = time_physics('numpy')
+    print("physics step + contacts: pymunk %.1fus, numpy %.1fus, speedup %.1fx" %
+          (pymunk_time * 1e6, numpy_time * 1e6, pymunk_time / numpy_time))
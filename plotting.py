@@ -1,29 +1,99 @@
 """
 Take the data in the results folder and plot it so we can stop using stupid
 Excel.
+
+Logs are parsed in one vectorized pass and the parsed arrays are cached in
+a .cache folder next to them, keyed on the log's mtime and size. A plot is
+only rendered again when its log changed, and the plots of all runs are
+rendered by a process pool:
+
+    python plotting.py [folder ...] [--workers N] [--force]
 """
 
 import glob
 import os
-import csv
-import matplotlib.pyplot as plt
+import time
 import numpy as np
 
+from metrics import read_metrics
+from util import atomic_write, pool_imap
+
+LOG_DIR = 'results/logs'
+CACHE_DIR = '.cache'
+
+
+def pyplot():
+    """
+    matplotlib.pyplot, imported by the first plot rendered, so commands
+    which find no stale plot never import it.
+    """
+    import matplotlib
+    # Plots are only saved to files, no window needed
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
 
 def movingaverage(y, window_size):
     """
-    Moving average function from:
-    http://stackoverflow.com/questions/11352047/finding-moving-average-from-data-points-in-python
+    Moving average with the same output as
+    np.convolve(y, np.ones(window_size) / window_size, 'same'), in O(n)
+    from a cumulative sum instead of O(n * window_size).
     """
-    window = np.ones(int(window_size))/float(window_size)
-    return np.convolve(y, window, 'same')
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    window_size = int(window_size)
+    c = np.concatenate(([0.], np.cumsum(y)))
+    # Output i averages y[i + half - window_size + 1 .. i + half], the
+    # values outside y count as 0
+    half = (window_size - 1) // 2
+    i = np.arange(n)
+    hi = np.minimum(i + half + 1, n)
+    lo = np.clip(i + half - window_size + 1, 0, n)
+    return (c[hi] - c[lo]) / window_size
+
+
+def load_csv(filename):
+    """Parse a numeric CSV file in one pass, one row per line"""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    lines = data.split(b'\n', 1)
+    if not lines[0].strip():
+        return np.zeros((0, 1))
+    columns = lines[0].count(b',') + 1
+    values = np.array(data.replace(b',', b' ').split(), dtype=float)
+    return values.reshape((-1, columns))
+
+
+def cache_path(filename):
+    folder, name = os.path.split(filename)
+    return os.path.join(folder, CACHE_DIR, name + '.npz')
+
+
+def load_log(filename):
+    """load_csv, cached until the file's mtime or size change"""
+    stat = os.stat(filename)
+    key = np.array([stat.st_mtime_ns, stat.st_size])
+    path = cache_path(filename)
+    try:
+        with np.load(path) as cached:
+            if np.array_equal(cached['key'], key):
+                return cached['data']
+    except (OSError, KeyError, ValueError):
+        pass
+
+    data = load_csv(filename)
+    # Another worker may read it
+    with atomic_write(path, 'wb') as f:
+        np.savez(f, data=data, key=key)
+    return data
 
 
 def readable_output(filename):
     readable = ''
     # Example:
     # path_data-128-128-100-10000-9.csv
-    f_parts = filename.split('-')
+    f_parts = os.path.basename(filename).split('-')
 
     if f_parts[0] == 'path_data':
         readable += 'distance: '
@@ -38,64 +108,136 @@ def readable_output(filename):
 
 
 def plot_file(filename, type='loss'):
-    with open(f, 'r') as csvfile:
-        reader = csv.reader(csvfile)
-        # Turn our column into an array.
-        y = []
-        x = []
-        for row in reader:
-            if type == 'loss':
-                y.append(float(row[0]))
-            else:
-                x.append(float(row[0]))
-                y.append(float(row[1]))
-
-        # Running tests will be empty.
-        if len(y) == 0:
-            return
-
-        print(readable_output(f))
-
-        # Get the moving average so the graph isn't so crazy.
-        if type == 'loss':
-            window = 100
-            y_av = movingaverage(y, window)
-        else:
-            y_av = y
-
-        # Use our moving average to get some metrics.
-        arr = np.array(y_av)
-        if type == 'loss':
-            print("%f\t%f\n" % (arr.min(), arr.mean()))
-        else:
-            print("%f\t%f\n" % (arr.max(), arr.mean()))
-
-        # Plot it.
-        plt.clf()  # Clear.
-        plt.title(f)
-        # The -50 removes an artificial drop at the end caused by the moving
-        # average.
-        if type == 'loss':
-            plt.plot(y_av)
-            plt.ylabel('Loss')
-            plt.xlabel('Num of Frames')
-            plt.ylim(0, 100000)
-          
-        else:
-            plt.plot(x, y_av)
-            plt.ylabel('Path Length')
-            plt.xlabel('Episode')
-            plt.ylim(0, 4000)
-
-        plt.savefig(f + '.png', bbox_inches='tight')
+    """Plot a path or loss CSV log, return the text summary"""
+    data = load_log(filename)
 
+    # Running tests will be empty.
+    if len(data) == 0:
+        return
 
-if __name__ == "__main__":
-    # Get our loss result files.
-    os.chdir("results/logs-0")
+    # Get the moving average so the graph isn't so crazy.
+    if type == 'loss':
+        window = 100
+        y_av = movingaverage(data[:, 0], window)
+    else:
+        x = data[:, 0]
+        y_av = data[:, 1]
+
+    # Use our moving average to get some metrics.
+    summary = readable_output(filename) + '\n'
+    if type == 'loss':
+        summary += "%f\t%f\n" % (y_av.min(), y_av.mean())
+    else:
+        summary += "%f\t%f\n" % (y_av.max(), y_av.mean())
+
+    # Plot it.
+    plt = pyplot()
+    plt.clf()  # Clear.
+    plt.title(os.path.basename(filename))
+    if type == 'loss':
+        plt.plot(y_av)
+        plt.ylabel('Loss')
+        plt.xlabel('Num of Frames')
+        plt.ylim(0, 100000)
+
+    else:
+        plt.plot(x, y_av)
+        plt.ylabel('Path Length')
+        plt.xlabel('Episode')
+        plt.ylim(0, 4000)
 
-    for f in glob.glob("path*.csv"):
-        plot_file(f, 'path')
+    plt.savefig(filename + '.png', bbox_inches='tight')
+    return summary
+
+
+def plot_metrics(filename):
+    """
+    Plot the loss and path lengths of a binary metrics file. It is memory
+    mapped, so this works while the run is still writing it.
+    """
+    records = read_metrics(filename)
+    losses = records['loss'][~np.isnan(records['loss'])]
+    goals = records[records['path_length'] > 0]
+
+    # Running tests will be empty.
+    if len(losses) == 0 and len(goals) == 0:
+        return
+
+    summary = filename + '\n'
+    plt = pyplot()
+    plt.clf()
+    plt.subplot(2, 1, 1)
+    plt.title(os.path.basename(filename))
+    if len(losses):
+        window = min(100, len(losses))
+        loss_av = movingaverage(losses, window)
+        summary += "%f\t%f\n" % (loss_av.min(), loss_av.mean())
+        plt.plot(loss_av)
+    plt.ylabel('Loss')
+    plt.xlabel('Num of Frames')
+
+    plt.subplot(2, 1, 2)
+    if len(goals):
+        summary += "%f\t%f\n" % (goals['path_length'].max(), goals['path_length'].mean())
+        plt.plot(goals['episode'], goals['path_length'], 'o-')
+    plt.ylabel('Path Length')
+    plt.xlabel('Episode')
+
+    plt.savefig(filename + '.png', bbox_inches='tight')
+    return summary
+
+
+def is_stale(filename):
+    """A plot has to be rendered if it's missing or older than its log"""
+    png = filename + '.png'
+    return not os.path.exists(png) or os.path.getmtime(png) < os.path.getmtime(filename)
+
+
+def plot_any(filename):
+    name = os.path.basename(filename)
+    if name.startswith('metrics'):
+        return plot_metrics(filename)
+    if name.startswith('path'):
+        return plot_file(filename, 'path')
+    return plot_file(filename, 'loss')
+
+
+def find_logs(folders):
+    logs = []
+    for folder in folders:
+        for pattern in ["path*.csv", "loss*.csv", "metrics*.bin"]:
+            logs.extend(sorted(glob.glob(os.path.join(folder, pattern))))
+    return logs
+
+
+def plot_all(folders=(LOG_DIR,), workers=None, force=False):
+    """
+    Render the plots of every log in folders which changed since its plot,
+    in a pool of workers processes. Return the summaries.
+    """
+    logs = [f for f in find_logs(folders) if force or is_stale(f)]
+    return list(pool_imap(plot_any, logs, workers))
+
+
+def add_arguments(parser):
+    parser.add_argument('folders', nargs='*', default=[LOG_DIR])
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true',
+                        help='render every plot, even if its log did not change')
+
+
+def main(args):
+    start = time.time()
+    summaries = plot_all(args.folders, args.workers, args.force)
+    for summary in summaries:
+        if summary:
+            print(summary)
+    print("%d plots in %.1fs" % (len(summaries), time.time() - start))
+
+
+if __name__ == "__main__":
+    import argparse
 
-    for f in glob.glob("loss*.csv"):
-        plot_file(f, 'loss')
+    parser = argparse.ArgumentParser(description="Plot the training logs")
+    add_arguments(parser)
+    main(parser.parse_args())
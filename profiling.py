@@ -0,0 +1,161 @@
+"""
+Per-phase timers for the training loop.
+
+Code wraps its phases in `with profiler.phase('fit'):` and calls
+profiler.frame() once per frame. A phase counts its own time only, the
+time of the phases nested in it goes to them. Every report_every frames
+the time per frame of each phase and the frames per second are printed,
+and written to a metrics file if one is given. When the profiler is
+disabled, which is the default, phase() returns a shared no-op context
+and frame() returns at once.
+
+capture(frames) profiles the next frames with cProfile, also on demand
+by sending SIGUSR1 to the process once install_signal() was called.
+"""
+
+import sys
+import time
+import cProfile
+import pstats
+import signal
+import numpy as np
+
+from metrics import MetricsWriter
+
+# Phases with a column in the profile metrics file
+PHASES = ['act', 'frame_step', 'physics', 'crowd', 'render', 'state', 'replay',
+          'sample', 'process_minibatch', 'priorities', 'fit', 'sync', 'metrics']
+
+# One record per report: the last frame, frames per second, and the
+# seconds per frame of each phase and of the time outside any phase
+PROFILE_RECORD = np.dtype([('frame', '<i8'), ('fps', '<f4')] +
+                          [(name, '<f4') for name in PHASES + ['other']])
+
+
+class NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_PHASE = NullPhase()
+
+
+class Phase:
+    __slots__ = ('profiler', 'name', 'start', 'children')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.children = 0.
+        self.profiler.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        profiler = self.profiler
+        profiler.stack.pop()
+        profiler.totals[self.name] = profiler.totals.get(self.name, 0.) + elapsed - self.children
+        if profiler.stack:
+            profiler.stack[-1].children += elapsed
+        return False
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.metrics = None
+        self.capture_frames = 0
+        self.cprofile = None
+        self.capture_path = None
+
+    def enable(self, report_every=1000, metrics_path=None, out=sys.stdout):
+        """Start timing, report every report_every frames"""
+        self.enabled = True
+        self.report_every = report_every
+        self.metrics = MetricsWriter(metrics_path, PROFILE_RECORD, flush_every=1) if metrics_path else None
+        self.out = out
+        self.reset()
+        self.frames = 0
+
+    def disable(self):
+        self.enabled = False
+        if self.metrics is not None:
+            self.metrics.close()
+
+    def reset(self):
+        self.totals = {}
+        self.stack = []
+        self.window_frames = 0
+        self.window_start = time.perf_counter()
+
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_PHASE
+        return Phase(self, name)
+
+    def frame(self):
+        """Count a frame, report and run the cProfile window when due"""
+        if self.capture_frames:
+            self.step_capture()
+        if not self.enabled:
+            return
+        self.frames += 1
+        self.window_frames += 1
+        if self.window_frames >= self.report_every:
+            self.report()
+
+    def breakdown(self):
+        """Frames per second and seconds per frame of each phase"""
+        wall = time.perf_counter() - self.window_start
+        frames = max(self.window_frames, 1)
+        per_frame = {name: total / frames for name, total in self.totals.items()}
+        per_frame['other'] = max(wall - sum(self.totals.values()), 0.) / frames
+        return frames / wall, per_frame
+
+    def report(self):
+        fps, per_frame = self.breakdown()
+        frame_time = sum(per_frame.values())
+        lines = ["frames %d-%d: %.0f frames/s" % (self.frames - self.window_frames, self.frames, fps)]
+        for name, seconds in sorted(per_frame.items(), key=lambda item: -item[1]):
+            lines.append("  %-18s %8.3fms %5.1f%%" % (name, seconds * 1e3,
+                                                     100 * seconds / max(frame_time, 1e-12)))
+        print('\n'.join(lines), file=self.out)
+        if self.metrics is not None:
+            record = {name: per_frame.get(name, 0.) for name in PHASES + ['other']}
+            self.metrics.write(frame=self.frames, fps=fps, **record)
+        self.reset()
+
+    def capture(self, frames=1000, path=None):
+        """Run cProfile over the next frames, then print and save the stats"""
+        self.capture_frames = frames
+        self.capture_path = path
+
+    def step_capture(self):
+        if self.cprofile is None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+            return
+        self.capture_frames -= 1
+        if self.capture_frames == 0:
+            self.cprofile.disable()
+            stats = pstats.Stats(self.cprofile, stream=sys.stdout)
+            if self.capture_path:
+                stats.dump_stats(self.capture_path)
+            stats.sort_stats('cumulative').print_stats(25)
+            self.cprofile = None
+
+    def install_signal(self, frames=1000, path=None):
+        """Capture the next frames when the process receives SIGUSR1"""
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, stack: self.capture(frames, path))
+
+
+# The profiler shared by trainning, GameClass and the other modules
+profiler = Profiler()
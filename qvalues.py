@@ -0,0 +1,54 @@
+"""
+Q value helpers for the two kinds of network built by nn.neural_net.
+
+They only call model.predict, so they work the same with a Keras model
+or an inference.NumpyModel, and this module imports no Keras: actor
+processes and testing can choose actions without loading TensorFlow.
+"""
+
+import numpy as np
+
+
+# The features are [state,encoded action]
+def get_features(state, action):
+    # encode the action into a 3 element vector [1,0,0],[0,1,0], or[0,0,1]
+    action_enc = np.zeros(3)
+    action_enc[action] = 1
+    features = np.hstack((state, action_enc))
+    features = features.reshape((1, -1))
+    return features
+
+# get_features for a batch of states and actions, one row per pair
+def get_features_batch(states, actions):
+    states = np.atleast_2d(states)
+    action_enc = np.zeros((len(states), 3))
+    action_enc[np.arange(len(states)), actions] = 1
+    return np.hstack((states, action_enc))
+
+def is_multi_head(model):
+    # A multi-head model maps a state to the values of all 3 actions
+    return model.output_shape[-1] == 3
+
+def state_size(model):
+    # Length of the state vectors the model was built for
+    if is_multi_head(model):
+        return model.input_shape[-1]
+    return model.input_shape[-1] - 3
+
+def predict_q(model, states):
+    """Q values of the 3 actions for a batch of states, in one forward pass"""
+    states = np.asarray(states).reshape((-1, state_size(model)))
+    if is_multi_head(model):
+        return model.predict(states, batch_size=len(states))
+    # One (state, action) feature row per pair
+    num = len(states)
+    features = get_features_batch(np.repeat(states, 3, axis=0), np.tile(np.arange(3), num))
+    return model.predict(features, batch_size=len(features)).reshape((num, 3))
+
+def choose_actions(model, states, epsilon):
+    """Epsilon greedy actions for a batch of states, e.g. from VecGameClass"""
+    num = len(states)
+    actions = np.argmax(predict_q(model, states), axis=1)
+    explore = np.random.random(num) < epsilon
+    actions[explore] = np.random.randint(0, 3, explore.sum())
+    return actions
@@ -0,0 +1,211 @@
+"""
+Experience replay memory stored in preallocated NumPy arrays.
+
+Transitions are written at a circular index, so adding one never copies
+the buffer, and a minibatch is a few index gathers that return contiguous
+arrays. With prioritized=True transitions are sampled in proportion to
+their priority through a sum-tree (Schaul et al., Prioritized Experience
+Replay, 2015).
+
+With a target network, max_a Q(state_new, a) of every slot is cached
+after its first prediction, until the next target sync or until the slot
+is overwritten, so a transition sampled again costs no forward pass.
+"""
+
+import numpy as np
+
+from qvalues import predict_q
+
+
+class SumTree:
+    """Binary tree whose parents hold the sum of their children"""
+    def __init__(self, capacity):
+        # Round up to a power of 2 so every level is full
+        self.leaves = 1
+        while self.leaves < capacity:
+            self.leaves *= 2
+        self.tree = np.zeros(2 * self.leaves)
+
+    def total(self):
+        return self.tree[1]
+
+    def update(self, indices, priorities):
+        nodes = np.asarray(indices) + self.leaves
+        self.tree[nodes] = priorities
+        # Recompute the parents one level at a time. Shared parents are
+        # written several times with the same sum.
+        nodes = nodes // 2
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes //= 2
+
+    def set(self, index, priority):
+        """update() for a single leaf, cheaper without array overhead"""
+        node = index + self.leaves
+        tree = self.tree
+        tree[node] = priority
+        node //= 2
+        while node >= 1:
+            tree[node] = tree[2 * node] + tree[2 * node + 1]
+            node //= 2
+
+    def find(self, values):
+        """Leaf index of every value in [0, total), searched all at once"""
+        values = np.array(values, dtype=float)
+        nodes = np.ones(len(values), dtype=int)
+        while nodes[0] < self.leaves:
+            left = 2 * nodes
+            left_sums = self.tree[left]
+            go_right = values >= left_sums
+            values -= left_sums * go_right
+            nodes = left + go_right
+        return nodes - self.leaves
+
+
+class ReplayMemory:
+    def __init__(self, capacity, state_dim, prioritized=False, alpha=0.6, beta=0.4):
+        """
+        capacity: number of transitions kept, the oldest are overwritten.
+        state_dim: length of a state vector.
+        prioritized: sample with a sum-tree on priority ** alpha, and return
+            importance sampling weights with exponent beta.
+        """
+        self.capacity = capacity
+        self.states = np.zeros((capacity, state_dim))
+        self.actions = np.zeros(capacity, dtype=int)
+        self.rewards = np.zeros(capacity)
+        self.states_new = np.zeros((capacity, state_dim))
+        self.index = 0
+        self.size = 0
+        self.rng = np.random.default_rng()
+
+        # Cached max Q of the target network, a slot's value is valid
+        # while its version is the version of the target network
+        self.max_q = np.zeros(capacity)
+        self.max_q_version = np.full(capacity, -1)
+        self.target_version = 0
+
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        if prioritized:
+            self.tree = SumTree(capacity)
+            self.max_priority = 1.
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, state_new):
+        i = self.index
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.states_new[i] = state_new
+        self.max_q_version[i] = -1
+        if self.prioritized:
+            # New transitions are sampled at least once with high probability
+            self.tree.set(i, self.max_priority ** self.alpha)
+
+        self.index = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return i
+
+    def add_batch(self, states, actions, rewards, states_new):
+        """add() for arrays of transitions, e.g. sent by an actor process"""
+        num = len(actions)
+        if num == 0:
+            return np.zeros(0, dtype=int)
+        if num > self.capacity:
+            states, actions = states[-self.capacity:], actions[-self.capacity:]
+            rewards, states_new = rewards[-self.capacity:], states_new[-self.capacity:]
+            num = self.capacity
+        indices = (self.index + np.arange(num)) % self.capacity
+        self.states[indices] = states
+        self.actions[indices] = actions
+        self.rewards[indices] = rewards
+        self.states_new[indices] = states_new
+        self.max_q_version[indices] = -1
+        if self.prioritized:
+            self.tree.update(indices, np.full(num, self.max_priority ** self.alpha))
+
+        self.index = (self.index + num) % self.capacity
+        self.size = min(self.size + num, self.capacity)
+        return indices
+
+    def sample(self, batch_size):
+        """
+        Return (states, actions, rewards, states_new), the slot indices and
+        the importance sampling weights of a random minibatch.
+        """
+        if self.prioritized:
+            # One uniform value in each of batch_size equal segments
+            segment = self.tree.total() / batch_size
+            values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+            indices = np.minimum(self.tree.find(values), self.size - 1)
+            probs = self.tree.tree[indices + self.tree.leaves] / self.tree.total()
+            weights = (self.size * probs) ** -self.beta
+            weights /= weights.max()
+        else:
+            indices = self.rng.integers(0, self.size, batch_size)
+            weights = np.ones(batch_size)
+
+        minibatch = (self.states.take(indices, axis=0), self.actions.take(indices),
+                     self.rewards.take(indices), self.states_new.take(indices, axis=0))
+        return minibatch, indices, weights
+
+    def max_q_values(self, indices, target):
+        """
+        max_a Q(state_new, a) of the target network for the given slots.
+        Only the slots without a valid cached value are predicted, in one
+        forward pass.
+        """
+        missing = self.max_q_version.take(indices) != self.target_version
+        if missing.any():
+            slots = np.unique(indices[missing])
+            self.max_q[slots] = predict_q(target, self.states_new.take(slots, axis=0)).max(axis=1)
+            self.max_q_version[slots] = self.target_version
+        return self.max_q.take(indices)
+
+    def invalidate_max_q(self):
+        """Forget every cached max Q, to call when the target network changes"""
+        self.target_version += 1
+
+    def update_priorities(self, indices, priorities):
+        """Set new priorities, e.g. the absolute TD errors, of sampled slots"""
+        priorities = np.asarray(priorities) + 1e-6
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(indices, priorities ** self.alpha)
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    # Cost of one frame of trainning.train: store a transition and
+    # sample a minibatch, with full memories.
+    capacity = 100000
+    frames = 10000
+    batch_size = 100
+    state = np.zeros(3)
+
+    # The old list replay
+    replay = [(state, 2, -1., state)] * capacity
+    start = time.time()
+    for t in range(frames):
+        replay.append((state, 2, -1., state))
+        replay.pop(0)
+        minibatch = random.sample(replay, batch_size)
+    print("list: %.1fus per frame" % ((time.time() - start) / frames * 1e6))
+
+    for prioritized in [False, True]:
+        memory = ReplayMemory(capacity, 3, prioritized=prioritized)
+        for t in range(capacity):
+            memory.add(state, 2, -1., state)
+        start = time.time()
+        for t in range(frames):
+            memory.add(state, 2, -1., state)
+            minibatch, indices, weights = memory.sample(batch_size)
+            if prioritized:
+                memory.update_priorities(indices, np.random.random(batch_size))
+        print("ReplayMemory, prioritized=%s: %.1fus per frame" %
+              (prioritized, (time.time() - start) / frames * 1e6))
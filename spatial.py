@@ -0,0 +1,135 @@
+"""
+Uniform grid spatial hash over axis aligned boxes.
+
+Every item (an obstacle circle, a border segment...) is stored in the
+grid cells its bounding box overlaps, so a query only looks at the items
+of the few cells around it instead of scanning all of them. The cells are
+kept as a sorted array of (cell, item) entries, built in one NumPy pass
+like crowd.neighbor_pairs, which a query reads with one bisection per
+row of cells.
+"""
+
+import math
+from bisect import bisect_left
+import numpy as np
+
+
+# The cell (i, j) is stored under the key i * KEY_STRIDE + j, so the
+# cells of a row are consecutive keys
+KEY_STRIDE = 1 << 32
+# Below this many items, testing them all costs less than a query
+INDEX_MIN = 500
+
+
+class SpatialHash:
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        # item id -> (i0, j0, i1, j1) range of cells it is stored in
+        self.ranges = {}
+        # One entry per (cell, item), sorted by cell key. Rebuilt by the
+        # first query after a change, the items rarely move.
+        self.keys = None
+        self.items = None
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def cell_range(self, xmin, ymin, xmax, ymax):
+        c = self.cell_size
+        return (int(math.floor(xmin / c)), int(math.floor(ymin / c)),
+                int(math.floor(xmax / c)), int(math.floor(ymax / c)))
+
+    def insert(self, item, xmin, ymin, xmax, ymax):
+        """Store item, an int id, in the cells its box overlaps"""
+        self.ranges[item] = self.cell_range(xmin, ymin, xmax, ymax)
+        self.keys = None
+
+    def move(self, item, xmin, ymin, xmax, ymax):
+        r = self.cell_range(xmin, ymin, xmax, ymax)
+        if r != self.ranges.get(item):
+            self.ranges[item] = r
+            self.keys = None
+
+    def insert_circle(self, item, x, y, radius):
+        self.insert(item, x - radius, y - radius, x + radius, y + radius)
+
+    def insert_segment(self, item, a, b, radius):
+        self.insert(item, min(a[0], b[0]) - radius, min(a[1], b[1]) - radius,
+                    max(a[0], b[0]) + radius, max(a[1], b[1]) + radius)
+
+    def build(self):
+        # Every item is repeated once per cell of its range, in one pass
+        items = np.fromiter(self.ranges.keys(), dtype=int, count=len(self.ranges))
+        r = np.array(list(self.ranges.values()), dtype=np.int64).reshape(-1, 4)
+        rows = r[:, 3] - r[:, 1] + 1
+        counts = (r[:, 2] - r[:, 0] + 1) * rows
+        entry = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = np.repeat(rows, counts)
+        i = np.repeat(r[:, 0], counts) + entry // rows
+        j = np.repeat(r[:, 1], counts) + entry % rows
+        keys = i * KEY_STRIDE + j
+        order = np.argsort(keys, kind='stable')
+        # Lists, bisect on a few rows costs less than NumPy calls
+        self.keys = keys[order].tolist()
+        self.items = np.repeat(items, counts)[order].tolist()
+
+    def query(self, xmin, ymin, xmax, ymax):
+        """Ids of the items whose cells overlap the box, a sorted array"""
+        if self.keys is None:
+            self.build()
+        i0, j0, i1, j1 = self.cell_range(xmin, ymin, xmax, ymax)
+        keys, items = self.keys, self.items
+        # The entries of a row of the box are one run of the sorted keys
+        found = []
+        for i in range(i0, i1 + 1):
+            row = i * KEY_STRIDE
+            found += items[bisect_left(keys, row + j0):bisect_left(keys, row + j1 + 1)]
+        if i0 != i1 or j0 != j1:
+            # An item stored in several cells is found once per cell
+            found = set(found)
+        return np.array(sorted(found), dtype=int)
+
+    def query_circle(self, x, y, radius):
+        return self.query(x - radius, y - radius, x + radius, y + radius)
+
+
+def benchmark(counts=(10, 100, 1000, 10000), queries=1000):
+    """
+    Microseconds per call of the query paths the index serves, with and
+    without it. The arena grows with the number of obstacles, so they
+    stay as dense as the 10 of the default arena, and the robot is put at
+    random points of it between the calls.
+    """
+    import random
+    import time
+    from GameClass import GameClass, width, height, lidar_range
+
+    results = []
+    for n in counts:
+        scale = math.sqrt(n / 10.)
+        for spatial_index in [False, True]:
+            random.seed(0)
+            game = GameClass(draw_screen = False, display_path = False, fps = 60,
+                             physics = 'numpy', num_obstacles = n,
+                             spatial_index = spatial_index, lidar_beams = 16)
+            rng = np.random.RandomState(0)
+            game.move_obstacles(rng.uniform(0, 1, (n, 2)) * (width * scale, height * scale))
+            points = (rng.uniform(0, 1, (queries, 2)) * (width * scale, height * scale)).tolist()
+            paths = [
+                ('find_contacts', lambda x, y: game.space.find_contacts(x, y)),
+                ('get_sensor_data', lambda x, y: game.get_sensor_data(lidar_range)),
+                ('get_lidar_data', lambda x, y: game.get_lidar_data()),
+            ]
+            for name, query in paths:
+                start = time.time()
+                for x, y in points:
+                    game.robot_body.position = (x, y)
+                    query(x, y)
+                results.append((name, n, spatial_index, (time.time() - start) / queries))
+    return results
+
+
+if __name__ == "__main__":
+    for name, n, spatial_index, seconds in benchmark():
+        print("%-16s %5d obstacles, index=%-5s %8.1fus" %
+              (name, n, spatial_index, seconds * 1e6))
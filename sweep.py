@@ -0,0 +1,198 @@
+"""
+Run a grid of trainning.launch_learn parameters over a process pool.
+
+Each grid point is claimed by creating results/sweep/<filename>.claim
+with O_EXCL, which is atomic, so several sweeps (even started by hand on
+the same results folder) never train the same parameters twice. A
+finished point writes <filename>.done with its summary; running the sweep
+again skips those and reclaims claims left by dead processes, so an
+interrupted sweep resumes where it stopped.
+"""
+
+import os
+import csv
+import json
+import fcntl
+import socket
+import multiprocessing as mp
+
+from util import atomic_write
+
+SWEEP_DIR = 'results/sweep'
+
+
+def grid(nn_params, batchSizes, buffers):
+    param_list = []
+    for nn_param in nn_params:
+        for batchSize in batchSizes:
+            for buffer in buffers:
+                params = {
+                    "batchSize": batchSize,
+                    "buffer": buffer,
+                    "nn": nn_param
+                }
+                param_list.append(params)
+    return param_list
+
+
+def sweep_path(name, ext):
+    return os.path.join(SWEEP_DIR, name + ext)
+
+
+def is_done(name):
+    return os.path.isfile(sweep_path(name, '.done'))
+
+
+def is_stale(path):
+    """A claim is stale if its process died on this host"""
+    try:
+        with open(path) as f:
+            host, pid = f.read().split()
+    except (OSError, ValueError):
+        return False
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def claim(name):
+    """Atomically claim a grid point, return False if it is taken or done"""
+    os.makedirs(SWEEP_DIR, exist_ok=True)
+    if is_done(name):
+        return False
+    path = sweep_path(name, '.claim')
+    if os.path.exists(path) and not take_over(path):
+        return False
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        f.write('%s %d\n' % (socket.gethostname(), os.getpid()))
+    return True
+
+
+def take_over(path):
+    """
+    Remove the claim at path if its process died, return True if there is
+    no claim left. Takeovers hold a lock, so a process checks the claim
+    after any other one removed it: it then finds nothing, and O_EXCL
+    picks one of them, or the new claim, which isn't stale.
+    """
+    with open(os.path.join(SWEEP_DIR, 'takeover.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if is_stale(path):
+            os.remove(path)
+        return not os.path.exists(path)
+
+
+def finish(name, summary):
+    """Record the summary of a claimed grid point"""
+    with atomic_write(sweep_path(name, '.done')) as f:
+        json.dump(summary, f)
+    os.remove(sweep_path(name, '.claim'))
+
+
+def limit_threads(threads):
+    """Cap BLAS and TensorFlow threads, must run before they are imported"""
+    for var in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                'NUMEXPR_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS']:
+        os.environ[var] = str(threads)
+    # Train headless, nobody watches a sweep
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+
+def limit_tf_threads(threads):
+    # TensorFlow 1 ignores the environment, its session has to be configured
+    try:
+        import tensorflow as tf
+        from keras import backend as K
+    except ImportError:
+        return
+    if hasattr(tf, 'ConfigProto'):
+        config = tf.ConfigProto(intra_op_parallelism_threads=threads,
+                                inter_op_parallelism_threads=threads)
+        K.set_session(tf.Session(config=config))
+
+
+def run_config(params, threads):
+    """Train one grid point in a pool worker, return its summary or None"""
+    import trainning
+    trainning.DRAW_SCREEN = False
+    limit_tf_threads(threads)
+    return trainning.launch_learn(params)
+
+
+def run_sweep(param_list, workers, threads=1, summary_file=None):
+    """
+    Train every grid point not done yet with `workers` processes of
+    `threads` BLAS/TF threads each, then write the summary table of all
+    finished points. Return its rows.
+    """
+    # Children also inherit the caps through the environment, in case the
+    # main module they re-import already loads numpy or Keras.
+    limit_threads(threads)
+    ctx = mp.get_context('spawn')
+    # A fresh process per grid point, so no Keras graph outlives its run
+    with ctx.Pool(workers, initializer=limit_threads, initargs=(threads,),
+                  maxtasksperchild=1) as pool:
+        results = [pool.apply_async(run_config, (params, threads)) for params in param_list]
+        for params, result in zip(param_list, results):
+            try:
+                result.get()
+            except Exception as e:
+                # Its claim goes stale and the next sweep retries it
+                print("Failed %s: %r" % (params, e))
+    return write_summary(summary_file or os.path.join(SWEEP_DIR, 'summary.csv'))
+
+
+def write_summary(path):
+    """One row per finished grid point, sorted by final loss"""
+    rows = []
+    if os.path.isdir(SWEEP_DIR):
+        for name in sorted(os.listdir(SWEEP_DIR)):
+            if name.endswith('.done'):
+                with open(os.path.join(SWEEP_DIR, name)) as f:
+                    rows.append(json.load(f))
+    # Runs without any loss (nan) go last
+    rows.sort(key=lambda row: (row['final_loss'] != row['final_loss'], row['final_loss']))
+
+    fields = ['filename', 'nn', 'batchSize', 'buffer', 'episodes', 'frames',
+              'goals', 'mean_path', 'final_loss', 'train_steps_per_second', 'seconds']
+    with open(path, 'w') as f:
+        wr = csv.DictWriter(f, fields, extrasaction='ignore')
+        wr.writeheader()
+        wr.writerows(rows)
+    return rows
+
+
+def add_arguments(parser):
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--threads', type=int, default=1,
+                        help='BLAS/TF threads per worker')
+    parser.add_argument('--nn', type=int, nargs='+', default=[128, 256, 512, 1000],
+                        help='units of both hidden layers, one grid value each')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[40, 100])
+    parser.add_argument('--buffers', type=int, nargs='+', default=[10000, 20000])
+
+
+def main(args):
+    nn_params = [[units, units] for units in args.nn]
+    rows = run_sweep(grid(nn_params, args.batch_sizes, args.buffers), args.workers, args.threads)
+    for row in rows:
+        print("%s\tgoals %d\tloss %f\t%.0fs" %
+              (row['filename'], row['goals'], row['final_loss'], row['seconds']))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    add_arguments(parser)
+    main(parser.parse_args())
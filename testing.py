@@ -2,18 +2,36 @@
 Once a model is learned, use this to test and play it.
 """
 
-from GameClass import GameClass
-from trainning import get_features
+import os
+from GameClass import GamePool
+from qvalues import predict_q
 import numpy as np
-from nn import neural_net
-from keras.models import load_model
+# NumPy inference, loads a checkpoint in milliseconds without TensorFlow
+from inference import load_model
 
 FPS = 60
 
-def play(model):
+# The windows of the previous plays, reused by the next ones
+games = GamePool()
+
+def checkpoint_path(name):
+    # Training saves .npz checkpoints by default (trainning.CHECKPOINT_FORMAT),
+    # the ones shipped in saved-models were saved by Keras as .h5
+    path = 'saved-models/model_nn-' + name
+    return path + '.npz' if os.path.exists(path + '.npz') else path + '.h5'
+
+def play(model, seed=None, draw_screen=True, record=None, max_frames=None):
+    """
+    Play an episode with the model until it reaches the goal, or after
+    max_frames frames. With record, the episode is saved to that path for
+    video.py, which is much faster to watch later than a window now.
+    """
 
     path_length = 0
-    gameObject = GameClass(draw_screen = True, display_path = True, fps = FPS)
+    gameObject = games.acquire(seed, draw_screen = draw_screen, display_path = draw_screen,
+                               fps = FPS)
+    if record:
+        gameObject.start_recording()
 
     # Do nothing to get initial.
     _, state = gameObject.frame_step((2))
@@ -23,11 +41,8 @@ def play(model):
         path_length += 1
 
         # Choose action.
-        Q = np.zeros(3)
-        for a in range(3):
-            features = get_features(state,a)
-            Q[a] = model.predict(features)
-            action = (np.argmax(Q))
+        Q = predict_q(model, state)
+        action = np.argmax(Q[0])
 
         # Take action.
         reward, state = gameObject.frame_step(action)
@@ -36,18 +51,23 @@ def play(model):
         if path_length % 1000 == 0:
             print("Current distance: %d frames." % path_length)
 
-        if reward > 8000:
+        if reward > 8000 or path_length == max_frames:
             break
 
+    if record:
+        gameObject.stop_recording(record)
+    games.release(gameObject)
+    return path_length
+
 
 if __name__ == "__main__":
     m=9 # for 128
     n=9 # for 256
     p=9 # for 512
 
-    # saved_model = load_model('saved-models/model_nn-128-128-100-10000-' + str(m)+ '.h5')
-    # saved_model = load_model('saved-models/model_nn-256-256-100-10000-' + str(n)+ '.h5')
-    saved_model = load_model('saved-models/model_nn-512-512-100-10000-' + str(p)+ '.h5')
+    # saved_model = load_model(checkpoint_path('128-128-100-10000-' + str(m)))
+    # saved_model = load_model(checkpoint_path('256-256-100-10000-' + str(n)))
+    saved_model = load_model(checkpoint_path('512-512-100-10000-' + str(p)))
     
     play(saved_model)
 
@@ -2,36 +2,100 @@ from GameClass import GameClass
 import numpy as np
 import random
 import csv
-from nn import neural_net, LossHistory
-import os.path
+from qvalues import get_features_batch, is_multi_head, predict_q
+from replay import ReplayMemory
+from metrics import MetricsWriter, read_metrics
+from profiling import profiler
+from checkpoint import CheckpointWriter
+from inference import NumpyModel
+from sweep import grid, claim, finish, run_sweep
+from actor_learner import train_async
 import timeit
-from keras.utils import plot_model
 
 TUNING = False
 GAMMA = 0.9
-NUM_INPUT = 6
+# Moving pedestrians in the training games, they add 2 state values
+PEDESTRIANS = 0
+# Lidar beams of the robot, they add one state value each
+LIDAR_BEAMS = 0
+
+def num_inputs(pedestrians, lidar_beams):
+    # The state and the 3 action values
+    return (6 if pedestrians == 0 else 8) + lidar_beams
+
+NUM_INPUT = num_inputs(PEDESTRIANS, LIDAR_BEAMS)
 FPS = 60
+# Set to False to train headless, e.g. on a server without display
+DRAW_SCREEN = True
+# GameClass physics backend, 'pymunk' or the faster 'numpy'
+PHYSICS = 'pymunk'
+# Physics steps each chosen action is applied for, the agent decides,
+# predicts and stores a transition once per ACTION_REPEAT steps
+ACTION_REPEAT = 1
+# Throttle a drawn game to the wall clock, training doesn't wait for it
+REALTIME = False
+# With params['numpy_actor'], actions are chosen by a NumPy copy of the
+# model which is synced every ACTOR_SYNC training steps
+ACTOR_SYNC = 100
+# Parallel processes used when TUNING
+SWEEP_WORKERS = 4
+# With ACTORS > 0, games are played by that many actor processes while
+# this process only trains, see actor_learner.py
+ACTORS = 0
+# Print the time per frame of each phase of train every PROFILE_EVERY
+# frames and log it to results/logs/profile-*.bin. Independently,
+# `kill -USR1 <pid>` profiles the next PROFILE_EVERY frames with cProfile.
+PROFILE = False
+PROFILE_EVERY = 1000
+# Checkpoints are weights-only .npz files written by a background thread,
+# 'h5' saves the full Keras model with its optimizer state, blocking
+CHECKPOINT_FORMAT = 'npz'
+# Storage type of the .npz weights, 'float16' halves the files
+CHECKPOINT_DTYPE = 'float32'
 
 def train(model, params):
     filename = params_to_filename(params)
 
     EPISODE = 10
-    FRAMES = 4000
+    # Decisions per episode, an episode always lasts 4000 physics steps
+    FRAMES = 4000 // ACTION_REPEAT
     OBSERVE = FRAMES*3
     epsilon = 1
     batchSize = params['batchSize']
     buffer = params['buffer']
-    replay = []
-    minibatch = []
+    replay = ReplayMemory(buffer, NUM_INPUT - 3, prioritized = params.get('prioritized', False))
     total_frames = 0
     path_log = []
-    loss_log = []
+    # One record per frame, appended to the file while training
+    metrics = MetricsWriter(metrics_path(filename))
+    actor = NumpyModel.from_keras(model) if params.get('numpy_actor', False) else model
+    # With params['target_sync'], the targets come from a NumPy copy of the
+    # model synced every that many training steps, see target_max_q
+    target_sync = params.get('target_sync', 0)
+    target = NumpyModel.from_keras(model) if target_sync else None
+    # The learner schedule: after OBSERVE, params['gradient_steps'] training
+    # steps every params['train_every'] frames
+    train_every = params.get('train_every', 1)
+    gradient_steps = params.get('gradient_steps', 1)
+    train_steps = 0
+    train_seconds = 0.
+    checkpoints = checkpoint_writer()
+    if PROFILE:
+        profiler.enable(PROFILE_EVERY, 'results/logs/profile-' + filename + '.bin')
+    profiler.install_signal(PROFILE_EVERY, 'results/logs/profile-' + filename + '.prof')
 
     # min_path_length = 0
 
+    # One game for all the episodes, reset in place between them
+    gameObject = GameClass(draw_screen = DRAW_SCREEN, display_path = DRAW_SCREEN, fps = FPS,
+                           physics = PHYSICS, num_pedestrians = PEDESTRIANS,
+                           realtime = REALTIME, action_repeat = ACTION_REPEAT,
+                           lidar_beams = LIDAR_BEAMS)
+
     for m in range(EPISODE):
         print("Episode: %d" % (m))
-        gameObject = GameClass(draw_screen = True, display_path = True, fps = FPS)
+        if m > 0:
+            gameObject.reset()
 
         # Choose no action in the initial frame
         action = 2
@@ -43,39 +107,46 @@ def train(model, params):
                 print("Frames: %d" % (t))
 
             # Choose the action based on the epsilon greedy algorithm
-            if (random.random() < epsilon or total_frames < OBSERVE):  # choose random action
-                action = np.random.randint(0, 3)
-            else:  # choose best action from Q(s,a) values
-                # Let's run our Q function on (state,action) to get Q values for all possible actions
-                Q = np.zeros(3)
-                for a in range(3):
-                    features = get_features(state,a)
-                    Q[a] = model.predict(features, batch_size=batchSize)
-                    action = (np.argmax(Q))
+            with profiler.phase('act'):
+                if (random.random() < epsilon or total_frames < OBSERVE):  # choose random action
+                    action = np.random.randint(0, 3)
+                else:  # choose best action from Q(s,a) values
+                    # Let's run our Q function on (state,action) to get Q values for all possible actions
+                    Q = predict_q(actor, state)
+                    action = np.argmax(Q[0])
 
             # Execute the action, observe new state and reward
-            reward, state_new = gameObject.frame_step(action)
+            step_start = timeit.default_timer()
+            with profiler.phase('frame_step'):
+                reward, state_new = gameObject.frame_step(action)
+            step_time = timeit.default_timer() - step_start
             path_length = gameObject.num_steps
+            loss = train_time = np.nan
 
-            # Store the (state, action, reward, new state) pair in the replay
-            memory = state, action, reward, state_new
-            replay.append(memory)
-
-            # If we've stored enough in our buffer, pop the oldest.
-            if len(replay) > buffer:
-                replay.pop(0)
+            # Store the (state, action, reward, new state) pair in the replay,
+            # once the buffer is full it overwrites the oldest.
+            with profiler.phase('replay'):
+                replay.add(state, action, reward, state_new)
 
             # Randomly sample our experience replay memory if we have enough samples
             if total_frames > OBSERVE:
-                minibatch = random.sample(replay, batchSize)
-
-                # Process the minibatch to get the training data
-                X_train, y_train = process_minibatch(minibatch,model,batchSize)
-
-                # Train the model on this batch.
-                history = LossHistory()
-                model.fit(X_train, y_train, batch_size=batchSize,verbose=0,callbacks=[history])
-                loss_log.append(history.losses)
+                if (total_frames - OBSERVE) % train_every == 0:
+                    # The loss of the frame is the mean over its steps
+                    train_start = timeit.default_timer()
+                    loss = 0.
+                    for _ in range(gradient_steps):
+                        loss += learn(model, replay, batchSize, target)
+                        train_steps += 1
+
+                        if actor is not model and train_steps % ACTOR_SYNC == 0:
+                            with profiler.phase('sync'):
+                                actor.set_weights(model.get_weights())
+                        if target is not None and train_steps % target_sync == 0:
+                            with profiler.phase('sync'):
+                                sync_target(target, model, replay)
+                    loss /= gradient_steps
+                    train_time = timeit.default_timer() - train_start
+                    train_seconds += train_time
 
                 # Decrement epsilon over time.
                 if epsilon > 0.1:
@@ -84,8 +155,15 @@ def train(model, params):
             # Update the starting state with S'.
             state = state_new
 
+            reached = gameObject.check_reach_goal()
+            with profiler.phase('metrics'):
+                metrics.write(frame = total_frames, episode = m, reward = reward, epsilon = epsilon,
+                              loss = loss, path_length = path_length if reached else 0,
+                              step_time = step_time, train_time = train_time)
+            profiler.frame()
+
             # Stop this episode if we achieved the goal
-            if gameObject.check_reach_goal():
+            if reached:
                 # Log the robot's path length
                 path_log.append([m,path_length])
 
@@ -102,13 +180,39 @@ def train(model, params):
         
         # Save the model every episode after observation.
         if total_frames > OBSERVE:
-            model.save('saved-models/model_nn-'+filename+'-'+str(m)+'.h5', overwrite=True)
+            save_checkpoint(model, checkpoints, filename, m)
             print("Saving model %s - %d" % (filename, m))
 
     # Log results after we're done all episodes.
-    log_results(filename, path_log, loss_log,m)            
-
-def log_results(filename, path_log, loss_log,m):
+    metrics.close()
+    checkpoints.close()
+    if PROFILE:
+        profiler.disable()
+    losses = read_metrics(metrics_path(filename))['loss']
+    losses = losses[~np.isnan(losses)]
+    log_results(filename, path_log, losses,m)            
+
+    return {
+        'episodes': m + 1,
+        'frames': total_frames,
+        'goals': len(path_log),
+        'mean_path': float(np.mean([p for _, p in path_log])) if path_log else float('nan'),
+        'final_loss': float(np.mean(losses[-1000:])) if len(losses) else float('nan'),
+        'train_steps': train_steps,
+        'train_steps_per_second': train_steps / train_seconds if train_seconds else float('nan'),
+    }
+
+def checkpoint_writer():
+    return CheckpointWriter(np.dtype(CHECKPOINT_DTYPE))
+
+def save_checkpoint(model, checkpoints, filename, m):
+    path = 'saved-models/model_nn-' + filename + '-' + str(m)
+    checkpoints.save(model, path + '.' + CHECKPOINT_FORMAT)
+
+def metrics_path(filename):
+    return 'results/logs/metrics-' + filename + '.bin'
+
+def log_results(filename, path_log, losses,m):
     # Save the results to a file so we can graph it later.
     with open('results/logs/path_data-' + filename + '-' + str(m) + '-simple.csv', 'w') as pf:
         # path_length = list(map(lambda x:[x],path_log)) 
@@ -120,83 +224,132 @@ def log_results(filename, path_log, loss_log,m):
 
     with open('results/logs/loss_data-' + filename + '-' + str(m) + '-simple.csv', 'w') as lf:
         wr = csv.writer(lf)
-        for loss_item in loss_log:
-            wr.writerow(loss_item)
-
-# The features are [state,encoded action]
-def get_features(state, action):
-    # encode the action into a 3 element vector [1,0,0],[0,1,0], or[0,0,1]
-    action_enc = np.zeros(3)
-    action_enc[action] = 1
-    features = np.hstack((state, action_enc))
-    features = features.reshape((1,NUM_INPUT))
-    return features
-
-def process_minibatch(minibatch, model,batchSize):
-    features_batch = []
-    target_batch = []
-    for mem in minibatch:
-        state, action, reward, state_new = mem
-        features = get_features(state,action)
-        features_batch.append(features.reshape(NUM_INPUT))
-
-        Q = np.zeros(3)
-        for a in range(3):
-            features=get_features(state_new,a)
-            Q[a] = model.predict(features, batch_size=batchSize)
-        maxQ = np.max(Q)
-
-        # Check for terminal state and get predicted Q value
-        if reward < 8000:  # non-terminal state
-            target = (reward + (GAMMA * maxQ))
-        else:  # terminal state
-            target = reward
-
-        target_batch.append(target)
-
-    features_batch = np.array(features_batch)
-    target_batch = np.array(target_batch)
+        wr.writerows([loss] for loss in losses)
+
+def learn(model, replay, batchSize, target=None):
+    """
+    One training step on a minibatch sampled from the replay, return its
+    loss. train_on_batch is a single gradient step like fit on one batch,
+    without fit's callbacks and per call setup.
+    """
+    with profiler.phase('sample'):
+        minibatch, indices, weights = replay.sample(batchSize)
+
+    # Process the minibatch to get the training data
+    with profiler.phase('process_minibatch'):
+        max_q = target_max_q(replay, indices, target)
+        X_train, y_train = process_minibatch(minibatch,model,batchSize,max_q)
+
+    # Prioritize the transitions by their TD error
+    if replay.prioritized:
+        with profiler.phase('priorities'):
+            Q = model.predict(X_train, batch_size=batchSize)
+            errors = np.abs(y_train.reshape(Q.shape) - Q).sum(axis=1)
+            replay.update_priorities(indices, errors)
+    else:
+        weights = None
+
+    # Train the model on this batch.
+    with profiler.phase('fit'):
+        return float(model.train_on_batch(X_train, y_train, sample_weight=weights))
+
+def target_max_q(replay, indices, target):
+    # max Q of the new states from the target network and the replay's
+    # cache, None without a target network
+    if target is None:
+        return None
+    return replay.max_q_values(indices, target)
+
+def sync_target(target, model, replay):
+    target.set_weights(model.get_weights())
+    replay.invalidate_max_q()
+
+def process_minibatch(minibatch, model,batchSize,max_q=None):
+    # minibatch is the (states, actions, rewards, states_new) arrays
+    # sampled from the ReplayMemory. max_q is max_a Q(state_new, a) from
+    # a target network, else it is predicted with model.
+    states, actions, rewards, states_new = minibatch
+    num = len(states)
+
+    # Q values of the new states, and for a multi-head model of the states
+    # too, all in a single forward pass
+    if max_q is not None:
+        if is_multi_head(model):
+            Q_state = predict_q(model, states)
+        maxQ = max_q
+    else:
+        if is_multi_head(model):
+            Q = predict_q(model, np.vstack((states, states_new)))
+            Q_state, Q_new = Q[:num], Q[num:]
+        else:
+            Q_new = predict_q(model, states_new)
+        maxQ = np.max(Q_new, axis=1)
+
+    # Check for terminal state and get predicted Q value
+    non_terminal = rewards < 8000
+    targets = np.where(non_terminal, rewards + GAMMA * maxQ, rewards)
+
+    if is_multi_head(model):
+        # Only the value of the taken action moves towards its target
+        features_batch = states
+        target_batch = Q_state.copy()
+        target_batch[np.arange(num), actions] = targets
+    else:
+        features_batch = get_features_batch(states, actions)
+        target_batch = targets
     return features_batch, target_batch
 
 def params_to_filename(params):
-    return str(params['nn'][0]) + '-' + str(params['nn'][1]) + '-' + \
+    filename = str(params['nn'][0]) + '-' + str(params['nn'][1]) + '-' + \
             str(params['batchSize']) + '-' + str(params['buffer'])
+    if params.get('multi_head', False):
+        filename += '-multi'
+    # A learner schedule other than one step per frame
+    if params.get('train_every', 1) != 1 or params.get('gradient_steps', 1) != 1:
+        filename += '-%dx%d' % (params.get('train_every', 1), params.get('gradient_steps', 1))
+    # Pedestrians and the lidar widen the state, these models can't play
+    # the default game
+    if PEDESTRIANS > 0:
+        filename += '-ped%d' % PEDESTRIANS
+    if LIDAR_BEAMS > 0:
+        filename += '-lidar%d' % LIDAR_BEAMS
+    return filename
+
+def build_model(params):
+    # Keras is only imported by the commands building a model
+    from nn import neural_net
+    # params['multi_head'] selects the network that outputs the 3 action
+    # values from the state alone
+    if params.get('multi_head', False):
+        return neural_net(NUM_INPUT - 3, params['nn'], num_outputs = 3)
+    return neural_net(NUM_INPUT, params['nn'])
 
 def launch_learn(params):
     filename = params_to_filename(params)
     print("Trying %s" % filename)
-    # Make sure we haven't run this one.
-    if not os.path.isfile('results/logs/loss_data-' + filename + '-simple.csv'):
-        # Create file so we don't double test when we run multiple
-        # instances of the script at the same time.
-        open('results/logs/loss_data-' + filename + '-simple.csv', 'a').close()
+    # Make sure we haven't run this one. The claim is atomic so we don't
+    # double test when we run multiple instances of the script at the same time.
+    if claim(filename):
         print("Starting test.")
+        start = timeit.default_timer()
         # Train.
-        model = neural_net(NUM_INPUT, params['nn'])
-        train(model, params)
+        model = build_model(params)
+        summary = train(model, params)
+        summary.update(params, filename=filename, seconds=timeit.default_timer() - start)
+        finish(filename, summary)
+        return summary
     else:
         print("Already tested.")
 
 if __name__ == "__main__":
     if TUNING:
-        param_list = []
         nn_params = [[128, 128], [256, 256],
                      [512, 512], [1000, 1000]]
         batchSizes = [40, 100]
         buffers = [10000, 20000]
 
-        for nn_param in nn_params:
-            for batchSize in batchSizes:
-                for buffer in buffers:
-                    params = {
-                        "batchSize": batchSize,
-                        "buffer": buffer,
-                        "nn": nn_param
-                    }
-                    param_list.append(params)
-
-        for param_set in param_list:
-            launch_learn(param_set)
+        param_list = grid(nn_params, batchSizes, buffers)
+        run_sweep(param_list, workers = SWEEP_WORKERS)
     else:
         nn_param = [256,256]
         params = {
@@ -204,7 +357,11 @@ if __name__ == "__main__":
             "buffer": 10000,
             "nn": nn_param
         }
-        model = neural_net(NUM_INPUT, nn_param)
-        train(model, params)
+        model = build_model(params)
+        if ACTORS > 0:
+            train_async(model, params, num_actors = ACTORS)
+        else:
+            train(model, params)
+        # from keras.utils import plot_model
         # plot_model(model, to_file='saved-models/model_nn_01.png')
         
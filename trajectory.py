@@ -0,0 +1,88 @@
+"""
+Trajectories of the robot.
+
+PathBuffer stores the points of a path in a preallocated NumPy array,
+which doubles its capacity when it is full, so appending a point doesn't
+allocate and reading the whole path is a view of the array.
+
+TrajectoryRecorder records an episode of a GameClass, one row per
+physics step, and saves it as a small compressed .npz file. Games can
+then run headless at full speed while video.py renders the saved
+episodes offline.
+"""
+
+import os
+import numpy as np
+
+
+class PathBuffer:
+    def __init__(self, capacity=1024, dim=2):
+        self.points = np.empty((capacity, dim))
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, point):
+        if self.count == len(self.points):
+            grown = np.empty((2 * len(self.points), self.points.shape[1]))
+            grown[:self.count] = self.points
+            self.points = grown
+        self.points[self.count] = point
+        self.count += 1
+
+    def last(self):
+        return self.points[self.count - 1]
+
+    def array(self):
+        """The points so far, a view valid until the next append"""
+        return self.points[:self.count]
+
+    def clear(self):
+        self.count = 0
+
+
+# Columns of the steps array of a trajectory
+STEP_COLUMNS = ['x', 'y', 'angle', 'action', 'reward']
+
+
+class TrajectoryRecorder:
+    def __init__(self, scene):
+        """
+        scene: dict of the static part of the episode, as returned by
+            GameClass.scene(): size, radii, fps, obstacle and goal
+            positions, number of pedestrians.
+        """
+        self.scene = scene
+        self.steps = PathBuffer(dim=len(STEP_COLUMNS))
+        self.pedestrians = PathBuffer(dim=2 * scene['num_pedestrians']) \
+            if scene['num_pedestrians'] else None
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, x, y, angle, action, reward, pedestrians=None):
+        """Record a physics step, pedestrians are their (P, 2) positions"""
+        self.steps.append((x, y, angle, action, reward))
+        if self.pedestrians is not None:
+            self.pedestrians.append(pedestrians.ravel())
+
+    def save(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        arrays = dict(self.scene)
+        arrays['steps'] = self.steps.array().astype(np.float32)
+        if self.pedestrians is not None:
+            arrays['pedestrians'] = self.pedestrians.array().astype(np.float32).reshape(
+                (len(self.pedestrians), -1, 2))
+        np.savez_compressed(path, **arrays)
+
+
+def load_trajectory(path):
+    """The arrays of a saved trajectory, in a dict"""
+    with np.load(path) as data:
+        trajectory = {name: data[name] for name in data.files}
+    for name, column in zip(STEP_COLUMNS, trajectory['steps'].T):
+        trajectory[name] = column
+    return trajectory
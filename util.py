@@ -0,0 +1,59 @@
+"""
+Small helpers shared by the scripts: files written atomically, and jobs
+mapped over a pool of worker processes.
+"""
+
+import os
+import contextlib
+import multiprocessing as mp
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """
+    Yield the path to write instead of path, a name unique to the process,
+    renamed over path once written, so a reader sees the previous file or
+    the new one, never a partial file. For writers which take a path. The
+    name keeps the extension, Keras reads the format from it, and is
+    hidden so globs like 'saved-models/*.h5' skip it.
+    """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    root, ext = os.path.splitext(os.path.basename(path))
+    tmp = os.path.join(folder, '.%s.%d.tmp%s' % (root, os.getpid(), ext))
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    """Open path for writing, written atomically like atomic_path"""
+    with atomic_path(path) as tmp:
+        with open(tmp, mode) as f:
+            yield f
+
+
+def pool_imap(func, jobs, workers=None, chunksize=1, ordered=True):
+    """
+    Yield func(job) for every job, computed by a pool of workers processes,
+    one per CPU by default and never more than jobs. A single worker runs
+    the jobs in this process. Unordered results come as they finish. The
+    pool is terminated when the results are consumed or dropped.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return
+    workers = min(workers or os.cpu_count(), len(jobs))
+    if workers == 1:
+        yield from map(func, jobs)
+        return
+    with mp.Pool(workers) as pool:
+        if ordered:
+            yield from pool.imap(func, jobs, chunksize)
+        else:
+            yield from pool.imap_unordered(func, jobs, chunksize)
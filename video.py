@@ -0,0 +1,147 @@
+"""
+Render recorded trajectories offline.
+
+Episodes recorded with GameClass.start_recording (e.g. by testing.play
+with record=) are turned into videos, or folders of PNG frames, by a pool
+of worker processes, without a window:
+
+    python video.py results/trajectories/*.npz [--out results/videos] [--every 2] [--png]
+
+Videos are encoded by piping raw frames to ffmpeg, which has to be on the
+PATH; PNG frames need nothing besides pygame.
+"""
+
+import os
+import math
+import shutil
+import subprocess
+import numpy as np
+import pygame
+from pygame.color import THECOLORS
+
+from trajectory import load_trajectory
+from util import pool_imap
+
+OUT_DIR = 'results/videos'
+# Physics steps per video frame, 2 gives 30 frames/s for 60 steps/s
+EVERY = 2
+
+
+def background(trajectory):
+    """Surface with the borders, obstacles and goal, which never move"""
+    w, h = int(trajectory['width']), int(trajectory['height'])
+    surface = pygame.Surface((w, h))
+    surface.fill(THECOLORS['white'])
+    for a, b in trajectory['borders']:
+        pygame.draw.line(surface, THECOLORS['brown'], to_pygame(a, h), to_pygame(b, h), 10)
+    r = int(round(float(trajectory['obstacle_radius'])))
+    for p in trajectory['obstacles']:
+        pygame.draw.circle(surface, THECOLORS['blue'], to_pygame(p, h), r, 0)
+    pygame.draw.circle(surface, THECOLORS['red'], to_pygame(trajectory['goal'], h),
+                       int(round(float(trajectory['goal_radius']))), 0)
+    return surface
+
+
+def to_pygame(p, height):
+    return int(round(p[0])), int(round(height - p[1]))
+
+
+def frames(trajectory, every=EVERY):
+    """Yield a surface for every every-th physics step, the same one redrawn"""
+    base = background(trajectory)
+    h = base.get_height()
+    frame = base.copy()
+    robot_radius = int(round(float(trajectory['robot_radius'])))
+    ped_radius = int(round(float(trajectory['pedestrian_radius'])))
+    points = np.column_stack((trajectory['x'], h - trajectory['y']))
+    drawn = 0
+    steps = list(range(0, len(points), every))
+    # Always end on the last step
+    if steps and steps[-1] != len(points) - 1:
+        steps.append(len(points) - 1)
+    for step in steps:
+        # The path is drawn on the background as it grows
+        if step > drawn:
+            pygame.draw.aalines(base, THECOLORS['red'], False, points[drawn:step + 1].tolist())
+            drawn = step
+        frame.blit(base, (0, 0))
+
+        if 'pedestrians' in trajectory:
+            for p in trajectory['pedestrians'][step]:
+                pygame.draw.circle(frame, THECOLORS['green'], to_pygame(p, h), ped_radius, 0)
+
+        x, y, angle = trajectory['x'][step], trajectory['y'][step], trajectory['angle'][step]
+        center = to_pygame((x, y), h)
+        pygame.draw.circle(frame, THECOLORS['orange'], center, robot_radius, 0)
+        edge = (x + robot_radius * math.cos(angle), y + robot_radius * math.sin(angle))
+        pygame.draw.line(frame, THECOLORS['black'], center, to_pygame(edge, h), 2)
+        yield frame
+
+
+def render_trajectory(path, out, every=EVERY):
+    """
+    Render the trajectory saved at path to out: a video file if it has an
+    extension, else a folder of numbered PNG frames. Return the number of
+    frames.
+    """
+    trajectory = load_trajectory(path)
+    fps = float(trajectory['fps']) / every
+    count = 0
+    if os.path.splitext(out)[1]:
+        if shutil.which('ffmpeg') is None:
+            raise RuntimeError("ffmpeg is needed to encode %s, render PNG frames instead" % out)
+        size = '%dx%d' % (int(trajectory['width']), int(trajectory['height']))
+        encoder = subprocess.Popen(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+             '-s', size, '-r', '%g' % fps, '-i', '-', '-pix_fmt', 'yuv420p', out],
+            stdin=subprocess.PIPE)
+        try:
+            for frame in frames(trajectory, every):
+                encoder.stdin.write(pygame.image.tostring(frame, 'RGB'))
+                count += 1
+        finally:
+            encoder.stdin.close()
+            encoder.wait()
+        if encoder.returncode != 0:
+            raise RuntimeError("ffmpeg failed to encode %s" % out)
+    else:
+        os.makedirs(out, exist_ok=True)
+        for frame in frames(trajectory, every):
+            pygame.image.save(frame, os.path.join(out, '%05d.png' % count))
+            count += 1
+    return count
+
+
+def output_path(path, out_dir, png=False):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(out_dir, name if png else name + '.mp4')
+
+
+def render_one(args):
+    path, out, every = args
+    return render_trajectory(path, out, every)
+
+
+def render_all(paths, out_dir=OUT_DIR, every=EVERY, png=False, workers=None):
+    """Render every trajectory in paths, one per worker process at a time"""
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(path, output_path(path, out_dir, png), every) for path in paths]
+    return list(pool_imap(render_one, jobs, workers))
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Render recorded trajectories")
+    parser.add_argument('trajectories', nargs='+')
+    parser.add_argument('--out', default=OUT_DIR)
+    parser.add_argument('--every', type=int, default=EVERY,
+                        help='physics steps per frame')
+    parser.add_argument('--png', action='store_true', help='folders of PNG frames instead of videos')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.time()
+    counts = render_all(args.trajectories, args.out, args.every, args.png, args.workers)
+    print("%d trajectories, %d frames in %.1fs" % (len(counts), sum(counts), time.time() - start))